@@ -0,0 +1,140 @@
+# automap.py
+import re
+from functools import lru_cache
+import numpy as np
+from setup import FALLBACK_MAP, AUTOMAP_MIN_SCORE
+from globals import FALLBACK_MAP as KEAP_FALLBACK_MAP
+
+# Scores for the strongest kinds of match; fuzzy trigram scores are capped at FUZZY_MAX_SCORE,
+# below every prior, so only exact and prior matches score above it
+EXACT_SCORE = 1.0
+PRIOR_SCORE = 0.95
+FUZZY_MAX_SCORE = PRIOR_SCORE - 0.01
+
+# Known BlueSky -> Allied/KEAP field names, consulted as priors ahead of fuzzy matches
+FALLBACK_PRIORS = {}
+for fallback in (FALLBACK_MAP, KEAP_FALLBACK_MAP):
+    for t_col, s_col in fallback.items():
+        FALLBACK_PRIORS.setdefault(t_col, [])
+        if s_col not in FALLBACK_PRIORS[t_col]:
+            FALLBACK_PRIORS[t_col].append(s_col)
+
+def normalize_colname(col):
+    """
+    Lowercase and clean a column name for comparison and matching.
+    Strips asterisks and non-breaking spaces.
+    """
+    if not isinstance(col, str):
+        return ""
+    col = col.strip().lower().replace('*', '')
+    col = col.replace('\xa0', ' ')
+    col = ' '.join(col.split())
+    return col
+
+def name_tokens(col):
+    """Split a column name into lowercase word/number tokens ('cellPhone1' -> ['cell', 'phone', '1'])."""
+    if not isinstance(col, str):
+        return []
+    col = re.sub(r"([a-z])([A-Z])", r"\1 \2", col)
+    col = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1 \2", col)
+    return re.findall(r"[a-z]+|\d+", normalize_colname(col))
+
+def name_trigrams(col):
+    """Return the set of character trigrams of a column's token string, padded at the edges."""
+    text = " ".join(name_tokens(col))
+    if not text:
+        return set()
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def is_auto_match(score):
+    """True for scores of exact-name and fallback-map matches, the only ones applied without review."""
+    return score > FUZZY_MAX_SCORE
+
+class ColumnIndex:
+    """
+    Precomputed lookup structures for the columns of one source frame.
+
+    Holds the selectbox options with an O(1) position lookup, a normalized-name
+    lookup for exact matches, and an inverted trigram index used to score template
+    fields against every source column at once.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.options = [''] + self.columns
+        self.position = {}
+        for i, col in enumerate(self.options):
+            self.position.setdefault(col, i)
+        self.by_name = {normalize_colname(col): col for col in self.columns}
+        postings = {}
+        sizes = []
+        for i, col in enumerate(self.columns):
+            grams = name_trigrams(col)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+        self.sizes = np.array(sizes, dtype=np.float64)
+
+    def fuzzy_scores(self, template_col):
+        """
+        Return (source positions, Dice similarity) for source columns sharing a trigram with template_col.
+        Only the postings of the field's own trigrams are touched, never the full column list.
+        """
+        grams = name_trigrams(template_col)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return np.array([], dtype=np.int64), np.array([])
+        ids, shared = np.unique(np.concatenate(hits), return_counts=True)
+        return ids, 2.0 * shared / (len(grams) + self.sizes[ids])
+
+    def suggest(self, template_columns, priors=None, top_k=3):
+        """
+        Rank source columns for every template field in one pass.
+        Exact normalized-name matches score EXACT_SCORE, fallback-map priors PRIOR_SCORE,
+        and everything else its trigram similarity (fuzzy matches below AUTOMAP_MIN_SCORE are dropped).
+        Returns: Dictionary {template_col: [(source_col, score), ...]}, best first.
+        """
+        priors = FALLBACK_PRIORS if priors is None else priors
+        suggestions = {}
+        for t_col in template_columns:
+            scores = {}
+            ids, sims = self.fuzzy_scores(t_col)
+            if len(ids) > top_k:
+                keep = np.argpartition(-sims, top_k)[:top_k]
+                ids, sims = ids[keep], sims[keep]
+            for i, sim in zip(ids.tolist(), sims.tolist()):
+                if sim >= AUTOMAP_MIN_SCORE:
+                    scores[self.columns[i]] = min(sim, FUZZY_MAX_SCORE)
+            for rank, prior in enumerate(priors.get(t_col, [])):
+                source_col = self.by_name.get(normalize_colname(prior))
+                if source_col is not None:
+                    # Earlier fallback maps win ties between priors
+                    scores[source_col] = max(scores.get(source_col, 0.0), PRIOR_SCORE - 0.001 * rank)
+            exact = self.by_name.get(normalize_colname(t_col))
+            if exact is not None:
+                scores[exact] = EXACT_SCORE
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            suggestions[t_col] = ranked[:top_k]
+        return suggestions
+
+    def best_matches(self, template_columns, priors=None):
+        """
+        Return {template_col: (source_col, score)} for fields whose best suggestion can be applied
+        automatically: an exact name or fallback-map match. Fuzzy matches are only ever suggestions
+        (a similar name such as 'State' for 'Status' is often a different field).
+        """
+        best = {}
+        for t_col, ranked in self.suggest(template_columns, priors, top_k=1).items():
+            if ranked and is_auto_match(ranked[0][1]):
+                best[t_col] = ranked[0]
+        return best
+
+@lru_cache(maxsize=8)
+def _cached_column_index(columns):
+    return ColumnIndex(columns)
+
+def build_column_index(columns):
+    """Return the ColumnIndex for a sequence of source columns, reusing it across reruns."""
+    return _cached_column_index(tuple(columns))
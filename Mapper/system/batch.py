@@ -0,0 +1,212 @@
+# batch.py (Allied version)
+"""
+Headless conversion of an Allied export, sharing the pipeline used by the Streamlit app.
+
+Usage (from Mapper/system):
+    python -m batch allied.xlsx --general general.csv --reqdoc reqdoc.csv \\
+        --specialty specialty.csv --mapping mapping.json --out output/ [--zip] [--chunk-size N]
+        [--state-dir state/ [--delta-only]] [--trace-memory] [--profile run.prof]
+    python -m batch exports/ more.xlsx --general ... --out output/ [--per-file] [--keep-duplicates]
+
+Several workbooks (or directories of them) are converted in a process pool with the templates
+and mapping read once, into combined outputs or one ZIP per source (see multifile.py).
+Per-stage timings, row counts and memory are logged as JSON lines (event "pipeline_stage").
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import pandas as pd
+from globals import logger, configure_logging
+from mapping import load_mappings
+from delta import run_delta, REMOVED_CSV
+from multifile import convert_many, expand_sources, COMBINED, PER_FILE
+from validation import validate_outputs
+from instrument import PerfRecorder, recording, tracing_memory, profiled
+from pipeline import (
+    read_template, read_allied, run_pipeline, run_pipeline_parallel, run_pipeline_chunked,
+    iter_excel_chunks, write_outputs, STAGES
+)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m batch",
+        description="Convert Allied Excel exports into BlueSky CSVs without the Streamlit UI."
+    )
+    parser.add_argument("allied", nargs="+", help="Allied Excel export(s) (.xlsx), or directories of them")
+    parser.add_argument("--general", required=True, help="BlueSky Caregiver General Info template CSV")
+    parser.add_argument("--reqdoc", required=True, help="BlueSky Caregiver Required Docs template CSV")
+    parser.add_argument("--specialty", required=True, help="BlueSky Caregiver Specialty template CSV")
+    parser.add_argument("--mapping", required=True, help="Saved mapping file (JSON, as downloaded from the app)")
+    parser.add_argument("--out", default=".", help="Output directory (default: current directory)")
+    parser.add_argument("--zip", action="store_true", help="Write a single ZIP instead of three CSVs")
+    parser.add_argument(
+        "--chunk-size", type=int, default=None, metavar="N",
+        help="Stream the workbook N rows at a time instead of loading it whole (bounds memory on huge exports)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, metavar="N",
+        help="Worker processes: for one export, run its stages (and row shards) in N processes (default: 1); "
+             "for several, convert N files at a time (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--per-file", action="store_true",
+        help="With several exports, write one <name>_BlueSky.zip per export instead of combined outputs"
+    )
+    parser.add_argument(
+        "--keep-duplicates", action="store_true",
+        help="With several exports combined, keep a Person_key's rows from every file (default: first file wins)"
+    )
+    parser.add_argument(
+        "--state-dir", default=None, metavar="DIR",
+        help="Convert incrementally: only workers whose Allied rows changed since the last run with this DIR are reprocessed"
+    )
+    parser.add_argument(
+        "--delta-only", action="store_true",
+        help="With --state-dir, write only added/changed workers' rows plus a CSV of removed Person_keys"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Report each stage's peak Python allocation via tracemalloc (slower)"
+    )
+    parser.add_argument(
+        "--profile", default=None, metavar="FILE",
+        help="Write a cProfile dump of the run to FILE (worker processes are not included)"
+    )
+    args = parser.parse_args(argv)
+    args.allied = expand_sources(args.allied)
+    if not args.allied:
+        parser.error("no .xlsx files found")
+    if len(args.allied) > 1 and (args.chunk_size or args.state_dir):
+        parser.error("--chunk-size and --state-dir work on a single export")
+    if args.delta_only and not args.state_dir:
+        parser.error("--delta-only requires --state-dir")
+    if args.state_dir and args.chunk_size:
+        parser.error("--state-dir cannot be combined with --chunk-size")
+    return args
+
+def log_validation(report):
+    """Log the data-quality summary as one JSON line (event "validation")."""
+    failures = {f"{output}/{rule}/{column}": count for (output, rule, column), count in report.failures.items()}
+    log = logger.warning if any(failures.values()) else logger.info
+    log(json.dumps({"event": "validation", "rows_with_issues": report.counts(), "failed_cells": failures}))
+
+def convert(allied_path, general_path, reqdoc_path, specialty_path, mapping_path, out_dir,
+            as_zip=False, chunk_size=None, workers=None, state_dir=None, delta_only=False):
+    """
+    Run one Allied export through the pipeline and write its outputs.
+    With chunk_size set, the workbook is streamed and outputs are appended chunk by chunk.
+    With workers > 1 (whole-file mode), stages and row shards run in a process pool.
+    With state_dir set, only changed workers are reprocessed (see delta.run_delta); delta_only
+    writes just their rows and the removed Person_keys instead of the full merged outputs.
+    Returns: List of written file paths.
+    """
+    started = time.perf_counter()
+    general_template = read_template(general_path)
+    reqdoc_template = read_template(reqdoc_path)
+    specialty_template = read_template(specialty_path)
+    general_mapping = load_mappings(mapping_path)["General Info"]
+    if chunk_size:
+        paths, counts = run_pipeline_chunked(
+            iter_excel_chunks(allied_path, chunk_size), general_template, reqdoc_template,
+            specialty_template, general_mapping, out_dir, as_zip=as_zip
+        )
+        general_rows, reqdoc_rows, specialty_rows = counts.values()
+    elif state_dir:
+        result = run_delta(
+            read_allied(allied_path), general_template, reqdoc_template, specialty_template,
+            general_mapping, state_dir
+        )
+        general, reqdoc_df, specialty_df = result["delta" if delta_only else "full"]
+        log_validation(validate_outputs(dict(zip(STAGES, (general, reqdoc_df, specialty_df)))))
+        paths = write_outputs(general, reqdoc_df, specialty_df, out_dir, as_zip=as_zip)
+        if delta_only:
+            removed_path = os.path.join(out_dir, REMOVED_CSV)
+            pd.DataFrame({"Person_key": result["removed"]}).to_csv(removed_path, index=False)
+            paths.append(removed_path)
+        general_rows, reqdoc_rows, specialty_rows = len(general), len(reqdoc_df), len(specialty_df)
+        logger.info("Delta against %s: %s", state_dir, result["stats"])
+    else:
+        allied = read_allied(allied_path)
+        if workers and workers > 1:
+            general, reqdoc_df, specialty_df = run_pipeline_parallel(
+                allied, general_template, reqdoc_template, specialty_template, general_mapping,
+                max_workers=workers
+            )
+        else:
+            general, reqdoc_df, specialty_df = run_pipeline(
+                allied, general_template, reqdoc_template, specialty_template, general_mapping
+            )
+        log_validation(validate_outputs(dict(zip(STAGES, (general, reqdoc_df, specialty_df)))))
+        paths = write_outputs(general, reqdoc_df, specialty_df, out_dir, as_zip=as_zip)
+        general_rows, reqdoc_rows, specialty_rows = len(general), len(reqdoc_df), len(specialty_df)
+    logger.info(
+        "Converted %s: %d general, %d required docs, %d specialty rows in %.1fs",
+        allied_path, general_rows, reqdoc_rows, specialty_rows, time.perf_counter() - started
+    )
+    return paths
+
+def convert_files(allied_paths, general_path, reqdoc_path, specialty_path, mapping_path, out_dir,
+                  as_zip=False, per_file=False, dedupe=True, workers=None):
+    """
+    Convert several Allied exports with the same templates and mapping, one worker process per file.
+    Returns: convert_many's report ({"files": [...], "outputs": [...]}).
+    """
+    started = time.perf_counter()
+    templates = [read_template(path) for path in (general_path, reqdoc_path, specialty_path)]
+    general_mapping = load_mappings(mapping_path)["General Info"]
+
+    def report_progress(files, index, done):
+        report = files[index]
+        if report["status"] == "failed":
+            logger.error("[%d/%d] %s failed: %s", done, len(files), report["name"], report["error"])
+        else:
+            logger.info("[%d/%d] %s converted", done, len(files), report["name"])
+
+    result = convert_many(
+        allied_paths, *templates, general_mapping, out_dir, mode=PER_FILE if per_file else COMBINED,
+        as_zip=as_zip, dedupe=dedupe, progress=report_progress, max_workers=workers
+    )
+    failed = sum(report["status"] == "failed" for report in result["files"])
+    dropped = sum(report["duplicates_dropped"] for report in result["files"])
+    logger.info(
+        "Converted %d of %d exports (%d duplicate Person_keys dropped) in %.1fs",
+        len(allied_paths) - failed, len(allied_paths), dropped, time.perf_counter() - started
+    )
+    return result
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    failed = False
+    try:
+        with recording(PerfRecorder(live=True)), tracing_memory(args.trace_memory), \
+                profiled(bool(args.profile)) as profile:
+            if len(args.allied) > 1:
+                result = convert_files(
+                    args.allied, args.general, args.reqdoc, args.specialty, args.mapping, args.out,
+                    as_zip=args.zip, per_file=args.per_file, dedupe=not args.keep_duplicates,
+                    workers=args.workers
+                )
+                paths = result["outputs"]
+                failed = any(report["status"] == "failed" for report in result["files"])
+            else:
+                paths = convert(
+                    args.allied[0], args.general, args.reqdoc, args.specialty,
+                    args.mapping, args.out, as_zip=args.zip,
+                    chunk_size=args.chunk_size, workers=args.workers,
+                    state_dir=args.state_dir, delta_only=args.delta_only
+                )
+        if args.profile:
+            with open(args.profile, "wb") as f:
+                f.write(profile["dump"])
+    except Exception:
+        logger.exception("Failed to convert %s", ", ".join(args.allied))
+        return 1
+    for path in paths:
+        print(path)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
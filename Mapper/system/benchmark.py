@@ -0,0 +1,457 @@
+# benchmark.py
+"""
+Reproducible pipeline benchmarks on synthetic Allied exports.
+
+Usage (from Mapper/system):
+    python -m benchmark [--rows 10k 100k 1m] [--repeat 3] [--null-rate 0.1]
+        [--cert-cardinality 40] [--specialty-cardinality 60] [--include-read]
+        [--extra-columns 250] [--out FILE] [--compare benchmarks/<commit>.json]
+    python -m benchmark --write-fixture fixtures/ --rows 10k
+    python -m benchmark --imports
+    python -m benchmark --str-columns 300 --rows 100k
+
+Stage timings come from the same instrumentation as the app (instrument.py); results are
+written as JSON (by default benchmarks/<commit>.json) so runs on two commits can be compared.
+`--str-columns N` instead times helpers.ensure_str_columns alone on a frame of N mixed columns,
+against the copy-and-replace loop it replaced. `--imports` checks that the modules used by the
+batch CLI and pool workers import no UI code and stay within an import-time budget on top of
+pandas (measured with `python -X importtime`).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from instrument import PerfRecorder, recording
+from helpers import ensure_str_columns
+from pipeline import ExportBundle, run_pipeline, read_allied, STAGES
+from validation import validate_outputs
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+# Stages compared between runs, in pipeline order
+BENCH_STAGES = [
+    "read_excel", "apply_mapping", "process_required_docs", "process_specialties",
+    "ensure_str_columns", "compact_str_columns", "validate", "to_csv", "zip", "total"
+]
+
+# Modules the batch CLI and pool workers import: no UI packages, and at most IMPORT_BUDGET_MS
+# of cold import time beyond pandas itself
+HEADLESS_MODULES = ["pipeline", "multifile", "delta", "validation", "batch"]
+UI_PACKAGES = ["streamlit"]
+IMPORT_BUDGET_MS = 100
+
+GENERAL_COLUMNS = [
+    "Person_key", "Fname", "MName", "Lname", "EMail", "Phone1", "cellPhone1", "ZIPCode",
+    "State", "BirthDate", "Region", "Category", "Status"
+]
+REQDOC_COLUMNS = ["Person_key", "CertificationCredentialName", "IssueComment", "Expiration Date", "Note", "Verified"]
+SPECIALTY_COLUMNS = ["Person_key", "Specialty", "Complete", "Complete Date", "Expiration Date", "UploadedFile"]
+
+# General Info template column -> synthetic Allied column
+GENERAL_MAPPING = {
+    "Person_key": "Id",
+    "Fname": "First Name",
+    "MName": "Middle Name",
+    "Lname": "Last Name",
+    "EMail": "Email",
+    "Phone1": "Phone",
+    "cellPhone1": "Phone",
+    "ZIPCode": "Postal Code",
+    "State": "State",
+    "BirthDate": "Birthday",
+    "Region": "",
+    "Category": "Category",
+    "Status": ""
+}
+
+# Extra template columns (--extra-columns) are named like this, and map to Allied columns "Extra NNN"
+EXTRA_TEMPLATE_COLUMN = "Custom Field {:03d}"
+EXTRA_ALLIED_COLUMN = "Extra {:03d}"
+# Every EXTRA_UNMAPPED_EVERY-th extra template column is left unmapped (written out blank)
+EXTRA_UNMAPPED_EVERY = 10
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "Maria", "Jose", "Wei", "Aisha", "Tenzin", "Olga", "Kenji", "Fatima", "Luis", "Priya"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Nguyen", "Kim", "Patel", "Dorjee", "O'Brien", "Schmidt", "Rossi", "Cohen", "Silva", "Khan"]
+STATES = ["CA", "TX", "FL", "NY", "PA", "IL", "OH", "GA", "NC", "MI", "WA", "AZ", "MA", "TN", "CO"]
+CATEGORIES = ["Allied", "Ancillary", "Therapy", "Imaging", "Lab"]
+
+def _vocabulary(prefix, size):
+    return np.array([f"{prefix} {idx:03d}" for idx in range(size)], dtype=object)
+
+def _with_nulls(values, null_rate, rng):
+    values = pd.Series(values)
+    return values.mask(rng.random(len(values)) < null_rate)
+
+def _joined_tokens(vocab, rows, max_tokens, rng):
+    """Comma-separated lists of 1..max_tokens random vocabulary entries per row."""
+    counts = rng.integers(1, max_tokens + 1, size=rows)
+    picks = vocab[rng.integers(0, len(vocab), size=(rows, max_tokens))]
+    joined = picks[:, 0].copy()
+    for slot in range(1, max_tokens):
+        extend = counts > slot
+        joined[extend] = joined[extend] + ", " + picks[extend, slot]
+    return joined
+
+def _extra_columns(rows, count, null_rate, rng):
+    """count extra Allied columns for wide templates, cycling through text, integer, float and date cells."""
+    words = _vocabulary("Value", 50)
+    start = pd.Timestamp("2000-01-01")
+    makers = [
+        lambda: words[rng.integers(0, len(words), size=rows)],
+        lambda: rng.integers(0, 100_000, size=rows),
+        lambda: rng.random(rows).round(2) * 1_000,
+        lambda: start + pd.to_timedelta(rng.integers(0, 9_000, size=rows), unit="D"),
+    ]
+    return {
+        EXTRA_ALLIED_COLUMN.format(idx): _with_nulls(makers[idx % len(makers)](), null_rate, rng)
+        for idx in range(count)
+    }
+
+def generate_allied(rows, cert_cardinality=40, specialty_cardinality=60, null_rate=0.1, max_certs=4, seed=0,
+                    extra_columns=0):
+    """
+    Build a synthetic Allied export with the columns the pipeline reads.
+    Certifications are comma-separated lists drawn from cert_cardinality names; specialties come from
+    specialty_cardinality names and repeat across the three columns (with case changes) so
+    deduplication has work to do. Every optional cell is blank with probability null_rate.
+    extra_columns: number of additional "Extra NNN" columns, for wide General Info templates
+                   (see generate_templates and general_mapping).
+    """
+    rng = np.random.default_rng(seed)
+    specialties = _vocabulary("Specialty", specialty_cardinality)
+    specialty1 = specialties[rng.integers(0, specialty_cardinality, size=rows)]
+    # About a third of second specialties repeat the first one, upper-cased
+    specialty2 = np.where(
+        rng.random(rows) < 0.33,
+        np.char.upper(specialty1.astype(str)).astype(object),
+        _joined_tokens(specialties, rows, 2, rng)
+    )
+    birthdays = pd.Timestamp("1950-01-01") + pd.to_timedelta(rng.integers(0, 18_000, size=rows), unit="D")
+    return pd.DataFrame({
+        "Id": np.arange(100_000, 100_000 + rows),
+        "First Name": _with_nulls(rng.choice(FIRST_NAMES, rows), null_rate, rng),
+        "Middle Name": _with_nulls(rng.choice(FIRST_NAMES, rows), max(null_rate, 0.5), rng),
+        "Last Name": _with_nulls(rng.choice(LAST_NAMES, rows), null_rate, rng),
+        "Email": _with_nulls([f"worker{idx}@example.com" for idx in range(rows)], null_rate, rng),
+        "Phone": _with_nulls(rng.integers(2_000_000_000, 9_999_999_999, size=rows), null_rate, rng),
+        "Postal Code": _with_nulls(rng.integers(1_000, 99_999, size=rows), null_rate, rng),
+        "State": _with_nulls(rng.choice(STATES, rows), null_rate, rng),
+        "Birthday": _with_nulls(birthdays, null_rate, rng),
+        "Category": _with_nulls(rng.choice(CATEGORIES, rows), null_rate, rng),
+        "Allied Certifications": _with_nulls(
+            _joined_tokens(_vocabulary("Certification", cert_cardinality), rows, max_certs, rng), null_rate, rng
+        ),
+        "Allied/Ancillary Specialty 1": _with_nulls(specialty1, null_rate, rng),
+        "Allied/Ancillary Specialty 2": _with_nulls(specialty2, max(null_rate, 0.3), rng),
+        "Allied/Ancillary Specialty 3": _with_nulls(
+            specialties[rng.integers(0, specialty_cardinality, size=rows)], max(null_rate, 0.6), rng
+        ),
+        **_extra_columns(rows, extra_columns, null_rate, rng)
+    })
+
+def generate_templates(extra_columns=0):
+    """
+    Return empty (general, reqdoc, specialty) BlueSky templates.
+    extra_columns: number of "Custom Field NNN" columns added to General Info, to benchmark wide templates.
+    """
+    general_columns = GENERAL_COLUMNS + [EXTRA_TEMPLATE_COLUMN.format(idx) for idx in range(extra_columns)]
+    return tuple(pd.DataFrame(columns=columns) for columns in (general_columns, REQDOC_COLUMNS, SPECIALTY_COLUMNS))
+
+def general_mapping(extra_columns=0):
+    """GENERAL_MAPPING plus the extra template columns, each mapped to its Allied column (a few left unmapped)."""
+    mapping = dict(GENERAL_MAPPING)
+    for idx in range(extra_columns):
+        unmapped = idx % EXTRA_UNMAPPED_EVERY == EXTRA_UNMAPPED_EVERY - 1
+        mapping[EXTRA_TEMPLATE_COLUMN.format(idx)] = "" if unmapped else EXTRA_ALLIED_COLUMN.format(idx)
+    return mapping
+
+def write_fixture(out_dir, allied, extra_columns=0):
+    """
+    Write the workbook, templates and mapping so a synthetic run can be reproduced with `python -m batch`.
+    extra_columns: as given to generate_allied for `allied`.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {"allied": os.path.join(out_dir, "allied.xlsx")}
+    allied.to_excel(paths["allied"], index=False)
+    for label, template in zip(("general", "reqdoc", "specialty"), generate_templates(extra_columns)):
+        paths[label] = os.path.join(out_dir, f"{label}_template.csv")
+        template.to_csv(paths[label], index=False)
+    paths["mapping"] = os.path.join(out_dir, "mapping.json")
+    with open(paths["mapping"], "w", encoding="utf-8") as f:
+        json.dump({STAGES[0]: general_mapping(extra_columns)}, f, indent=2)
+    return paths
+
+def _stage_key(name):
+    # Per-file serialization stages ("to_csv:<file>") are reported together
+    return name.split(":", 1)[0]
+
+def bench_once(allied, templates, workbook=None, mapping=GENERAL_MAPPING):
+    """Run the pipeline and export once; return {stage: seconds} and {stage: (rows in, rows out)}."""
+    recorder = PerfRecorder()
+    started = time.perf_counter()
+    with recording(recorder):
+        if workbook is not None:
+            allied = read_allied(io.BytesIO(workbook))
+        general, reqdoc_df, specialty_df = run_pipeline(allied, *templates, mapping)
+        validate_outputs(dict(zip(STAGES, (general, reqdoc_df, specialty_df))))
+        ExportBundle(general, reqdoc_df, specialty_df, recorder=recorder).zip_bytes()
+    seconds = {"total": time.perf_counter() - started}
+    rows = {}
+    for record in recorder.records:
+        key = _stage_key(record["stage"])
+        seconds[key] = seconds.get(key, 0.0) + record["seconds"]
+        rows_in, rows_out = rows.get(key, (0, 0))
+        rows[key] = (rows_in + (record["rows_in"] or 0), rows_out + (record["rows_out"] or 0))
+    return seconds, rows
+
+def run_benchmark(rows, repeat=3, include_read=False, **generator_options):
+    """
+    Benchmark one scale: generate the data once, then time `repeat` full runs.
+    Returns: dict with the parameters and, per stage, the min/median seconds and row counts.
+    """
+    allied = generate_allied(rows, **generator_options)
+    extra_columns = generator_options.get("extra_columns", 0)
+    templates, mapping = generate_templates(extra_columns), general_mapping(extra_columns)
+    workbook = None
+    if include_read:
+        buffer = io.BytesIO()
+        allied.to_excel(buffer, index=False)
+        workbook = buffer.getvalue()
+    runs = [bench_once(allied, templates, workbook, mapping) for _ in range(repeat)]
+    stages = {}
+    for name in BENCH_STAGES:
+        timings = [seconds[name] for seconds, _ in runs if name in seconds]
+        if not timings:
+            continue
+        rows_in, rows_out = runs[0][1].get(name, (None, None))
+        stages[name] = {
+            "min": round(min(timings), 4),
+            "median": round(float(np.median(timings)), 4),
+            "rows_in": rows_in,
+            "rows_out": rows_out
+        }
+    return {"rows": rows, "repeat": repeat, "include_read": include_read, "generator": generator_options,
+            "stages": stages}
+
+def _legacy_ensure_str_columns(df):
+    # The copy + astype(str) + replace loop ensure_str_columns replaced, kept as the baseline
+    df = df.copy()
+    for col in df.columns:
+        df[col] = df[col].astype(str)
+        df[col] = df[col].replace(['nan', 'NaT', '<NA>', 'None', 'none', 'NULL', 'null'], '', regex=False)
+        df[col] = df[col].replace({np.nan: '', None: ''})
+    return df
+
+def _timed(fn, prepare, repeat):
+    """Best wall time of fn(prepare()) over repeat runs, then its peak traced allocation in one more run."""
+    best = None
+    for _ in range(repeat):
+        arg = prepare()
+        started = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    arg = prepare()
+    tracemalloc.start()
+    try:
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def bench_str_columns(rows, columns, repeat=3, null_rate=0.1, seed=0):
+    """
+    Time string normalization of a wide frame: `columns` text, integer, float and date columns
+    (as generated for --extra-columns), normalized by the old copy-and-replace loop, by
+    ensure_str_columns, by ensure_str_columns in place, and again on its already-normalized output.
+    Returns: {variant: {"seconds": best wall time, "peak_mb": peak traced allocation}}.
+    """
+    frame = pd.DataFrame(_extra_columns(rows, columns, null_rate, np.random.default_rng(seed)))
+    normalized = ensure_str_columns(frame)
+    variants = {
+        "legacy loop": (_legacy_ensure_str_columns, lambda: frame),
+        "ensure_str_columns": (ensure_str_columns, lambda: frame),
+        "inplace": (lambda df: ensure_str_columns(df, inplace=True), frame.copy),
+        "already normalized": (ensure_str_columns, lambda: normalized),
+    }
+    results = {}
+    for name, (fn, prepare) in variants.items():
+        seconds, peak = _timed(fn, prepare, repeat)
+        results[name] = {"seconds": round(seconds, 4), "peak_mb": round(peak / 1024 ** 2, 1)}
+    return results
+
+def environment():
+    """Commit and machine details stored with every result file."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def import_time(module, repeat=3):
+    """
+    Import `module` in fresh interpreters under `python -X importtime`, after pandas so that
+    its own line measures only what it adds on top.
+    Returns: (best import time beyond pandas in ms, set of top-level packages imported overall).
+    """
+    best, packages = None, set()
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import pandas, {module}"], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        # Lines are "import time: self [us] | cumulative | name", children before their parent
+        fields = [line.split(":", 1)[1].split("|") for line in completed.stderr.splitlines()
+                  if line.startswith("import time:")][1:]
+        packages = {name.strip().split(".")[0] for _, _, name in fields}
+        ms = int(fields[-1][1]) / 1000
+        best = ms if best is None else min(best, ms)
+    return best, packages
+
+def check_imports(modules=HEADLESS_MODULES, budget_ms=IMPORT_BUDGET_MS, repeat=3):
+    """
+    Import time of each module beyond pandas, against budget_ms.
+    Returns: list of (module, ms, UI packages imported, failed).
+    """
+    rows = []
+    for module in modules:
+        ms, packages = import_time(module, repeat)
+        ui = sorted(packages.intersection(UI_PACKAGES))
+        rows.append((module, ms, ui, bool(ui) or ms > budget_ms))
+    return rows
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare median stage times of two result dicts (matched by row count).
+    Returns: list of (rows, stage, baseline seconds, current seconds, ratio, regressed).
+    """
+    previous = {result["rows"]: result["stages"] for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        if result["rows"] not in previous:
+            continue
+        for name, timing in result["stages"].items():
+            before = previous[result["rows"]].get(name)
+            if not before or not before["median"]:
+                continue
+            ratio = timing["median"] / before["median"]
+            rows.append((result["rows"], name, before["median"], timing["median"], ratio, ratio > 1 + threshold))
+    return rows
+
+def parse_scale(value):
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    try:
+        return int(value.replace("_", ""))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected one of {', '.join(SCALES)} or a row count, got {value!r}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Time the Allied conversion pipeline on synthetic exports."
+    )
+    parser.add_argument("--rows", nargs="+", type=parse_scale, default=[SCALES["10k"], SCALES["100k"]],
+                        metavar="SCALE", help="Row counts to run: 10k, 100k, 1m or a number (default: 10k 100k)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scale (default: 3)")
+    parser.add_argument("--cert-cardinality", type=int, default=40, help="Distinct certification names")
+    parser.add_argument("--specialty-cardinality", type=int, default=60, help="Distinct specialty names")
+    parser.add_argument("--null-rate", type=float, default=0.1, help="Share of blank optional cells (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generator")
+    parser.add_argument("--extra-columns", type=int, default=0, metavar="N",
+                        help=f"Add N mapped columns to the export and the General Info template, which has "
+                             f"{len(GENERAL_COLUMNS)} otherwise; e.g. 250 to time wide templates (default: 0)")
+    parser.add_argument("--include-read", action="store_true",
+                        help="Also time pd.read_excel on a generated workbook (writing it is slow at 1m rows)")
+    parser.add_argument("--out", default=None, help="Result JSON path (default: benchmarks/<commit>.json)")
+    parser.add_argument("--compare", default=None, metavar="FILE", help="Earlier result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Slowdown ratio above which a stage counts as a regression (default: 0.1 = 10%%)")
+    parser.add_argument("--imports", action="store_true",
+                        help=f"Only check the import time of the headless modules (budget: {IMPORT_BUDGET_MS} ms "
+                             "beyond pandas, no UI packages); exits with status 1 on failure")
+    parser.add_argument("--str-columns", type=int, default=None, metavar="N",
+                        help="Only time ensure_str_columns on a frame of N mixed columns (e.g. 300) at each "
+                             "--rows value, against the copy-and-replace loop it replaced")
+    parser.add_argument("--write-fixture", default=None, metavar="DIR",
+                        help="Only write a synthetic workbook, templates and mapping for the first --rows value")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    generator_options = {
+        "cert_cardinality": args.cert_cardinality,
+        "specialty_cardinality": args.specialty_cardinality,
+        "null_rate": args.null_rate,
+        "seed": args.seed,
+        "extra_columns": args.extra_columns
+    }
+    if args.write_fixture:
+        allied = generate_allied(args.rows[0], **generator_options)
+        for path in write_fixture(args.write_fixture, allied, args.extra_columns).values():
+            print(path)
+        return 0
+    if args.str_columns:
+        for rows in args.rows:
+            results = bench_str_columns(rows, args.str_columns, args.repeat, args.null_rate, args.seed)
+            for name, result in results.items():
+                print(f"{rows:>9,} rows x {args.str_columns} columns  {name:<20} "
+                      f"{result['seconds']:8.3f}s  peak {result['peak_mb']:8.1f} MB")
+        return 0
+    if args.imports:
+        failed = False
+        for module, ms, ui, over in check_imports(repeat=args.repeat):
+            flag = f"  OVER BUDGET{' (imports ' + ', '.join(ui) + ')' if ui else ''}" if over else ""
+            print(f"{module:<12} +{ms:7.1f} ms beyond pandas{flag}")
+            failed = failed or over
+        return 1 if failed else 0
+
+    report = {"environment": environment(), "results": []}
+    for rows in args.rows:
+        result = run_benchmark(rows, repeat=args.repeat, include_read=args.include_read, **generator_options)
+        report["results"].append(result)
+        for name, timing in result["stages"].items():
+            print(f"{rows:>9,} rows  {name:<22} median {timing['median']:8.3f}s  min {timing['min']:8.3f}s")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{report['environment']['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressed = False
+        for rows, name, before, after, ratio, slower in compare(baseline, report, args.threshold):
+            flag = "  REGRESSION" if slower else ""
+            print(f"{rows:>9,} rows  {name:<22} {before:8.3f}s -> {after:8.3f}s  x{ratio:.2f}{flag}")
+            regressed = regressed or slower
+        return 1 if regressed else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
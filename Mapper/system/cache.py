@@ -0,0 +1,173 @@
+# cache.py
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+import pandas as pd
+from setup import CACHE_MAX_ENTRIES, CACHE_MAX_BYTES
+from pipeline import read_template, read_allied, run_pipeline_parallel
+from validation import validate_outputs
+from jobstore import default_store
+
+# Rows sampled when estimating the in-memory size of a DataFrame
+SIZE_SAMPLE_ROWS = 1000
+
+def content_hash(data: bytes) -> str:
+    """Return a hex digest identifying the given bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def upload_bytes(upload) -> bytes:
+    """Return the full contents of an uploaded file (Streamlit UploadedFile, file-like, or path)."""
+    if hasattr(upload, "getvalue"):
+        return upload.getvalue()
+    if hasattr(upload, "read"):
+        upload.seek(0)
+        return upload.read()
+    with open(upload, "rb") as f:
+        return f.read()
+
+def mapping_hash(mapping) -> str:
+    """Return a stable digest of a {template_col: source_col} mapping."""
+    return content_hash(json.dumps(mapping or {}, sort_keys=True, default=str).encode())
+
+def estimate_nbytes(value) -> int:
+    """
+    Estimate the memory held by a DataFrame (or a tuple/list of them).
+    Object columns are measured on a sample of rows and scaled up, which keeps this cheap on large frames.
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if not isinstance(value, pd.DataFrame):
+        return 0
+    # Categorical columns are measured exactly (codes + categories); a row sample would count
+    # the full categories once per sample and scale them up with the row count
+    categorical = [i for i, dtype in enumerate(value.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+    exact = sum(
+        value.iloc[:, i].array.codes.nbytes + value.iloc[:, i].array.categories.memory_usage(deep=True)
+        for i in categorical
+    )
+    if categorical:
+        value = value.iloc[:, [i for i in range(value.shape[1]) if i not in set(categorical)]]
+    rows = len(value)
+    if rows <= SIZE_SAMPLE_ROWS:
+        return int(exact + value.memory_usage(index=True, deep=True).sum())
+    sample = value.iloc[:SIZE_SAMPLE_ROWS].memory_usage(index=True, deep=True).sum()
+    return int(exact + sample * rows / SIZE_SAMPLE_ROWS)
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by entry count and total estimated bytes.
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """Store value under key, evicting least-recently-used entries to stay within the limits."""
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                # Too large to ever fit; don't flush everything else for it
+                return value
+            self._entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+        return value
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+# Parsed uploads keyed by (kind, content hash); processed outputs keyed by input and mapping hashes
+frame_cache = LRUCache()
+result_cache = LRUCache()
+# (job ID, validation report) of the saved outputs, under the same keys as result_cache
+saved_jobs = LRUCache()
+
+def read_excel_cached(upload):
+    """
+    Parse an Allied workbook, reusing the frame from an earlier rerun if the bytes are unchanged.
+    Returns: (DataFrame, content hash).
+    """
+    data = upload_bytes(upload)
+    digest = content_hash(data)
+    allied = frame_cache.get_or_compute(("excel", digest), lambda: read_allied(io.BytesIO(data)))
+    return allied, digest
+
+def read_template_cached(upload):
+    """
+    Read a BlueSky template CSV, reusing the parsed frame if the bytes are unchanged.
+    Returns: (DataFrame, content hash).
+    """
+    data = upload_bytes(upload)
+    digest = content_hash(data)
+    template = frame_cache.get_or_compute(("template", digest), lambda: read_template(io.BytesIO(data)))
+    return template, digest
+
+def result_key(input_hashes, general_mapping):
+    """Cache key of the outputs for the given input content hashes and General Info mapping."""
+    return (tuple(input_hashes), mapping_hash(general_mapping))
+
+def run_pipeline_cached(allied, general_template, reqdoc_template, specialty_template,
+                        general_mapping, input_hashes, progress=None):
+    """
+    Run the conversion pipeline, reusing the outputs of an earlier run with the same inputs.
+    input_hashes: content hashes of the Allied workbook and the three templates.
+    progress: optional per-stage callback, see pipeline.run_pipeline_parallel (not called on a cache hit).
+    Returns: (general_df, reqdoc_df, specialty_df).
+    """
+    return result_cache.get_or_compute(
+        result_key(input_hashes, general_mapping),
+        lambda: run_pipeline_parallel(
+            allied, general_template, reqdoc_template, specialty_template, general_mapping, progress=progress
+        )
+    )
+
+def save_result_cached(outputs, input_hashes, general_mapping, meta=None):
+    """
+    Validate {output name: DataFrame} and save it to the job store, once per set of inputs: while
+    that job is still stored, later calls with the same inputs (Process clicked again on unchanged
+    files) return its ID and report without writing or validating anything.
+    input_hashes, general_mapping: as given to run_pipeline_cached for these outputs.
+    meta: optional details kept with a newly saved job (see JobStore.save).
+    Returns: (job ID, ValidationReport).
+    """
+    key = result_key(input_hashes, general_mapping)
+    saved = saved_jobs.get(key)
+    if saved is not None and default_store().meta(saved[0]) is not None:
+        return saved
+    saved = default_store().save(outputs, meta), validate_outputs(outputs)
+    return saved_jobs.put(key, saved)
@@ -0,0 +1,227 @@
+# delta.py
+"""
+Incremental conversion: only workers whose Allied rows changed since the previous run are reprocessed.
+
+A state directory keeps, from the last run, a hash of every worker's Allied row (keyed by Id)
+and the full outputs, each row tagged with its worker's position in that export. A new export is
+diffed against those hashes; added and changed workers are run through the pipeline, removed and
+changed workers' old rows are dropped, and the merged outputs come out in the same order a full
+run would produce. Outputs are kept as uncompressed Arrow files (see jobstore.write_frame) and only
+rewritten when their rows changed.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from helpers import ensure_str_columns, compact_str_values, mark_str_normalized, normalize_str_values
+from cache import mapping_hash
+from jobstore import read_frame, write_frame
+from pipeline import run_pipeline
+
+# Bump when pipeline output changes, so old state is not merged with new-style rows
+STATE_VERSION = 2
+STATE_FILE = "state.json"
+HASHES_FILE = "row_hashes.pkl"
+REMOVED_CSV = "BlueSky_Removed_Person_keys.csv"
+KEY_COLUMN = "__worker_position"
+OUTPUT_FILES = ["general.arrow", "reqdoc.arrow", "specialty.arrow"]
+
+def worker_keys(allied):
+    """Return each Allied row's Id as it appears in Person_key (string-normalized), or None if unusable."""
+    if "Id" not in allied.columns:
+        return None
+    keys = pd.Series(normalize_str_values(allied["Id"].astype(object)), dtype="string")
+    if (keys == "").any() or keys.duplicated().any():
+        return None
+    return keys
+
+def row_hashes(allied):
+    """Return one 64-bit content hash per Allied row (all columns, index ignored)."""
+    return pd.util.hash_pandas_object(allied, index=False).to_numpy()
+
+def _run_signature(general_template, reqdoc_template, specialty_template, general_mapping, allied):
+    """Everything besides row contents that determines the outputs; state is only reused if it matches."""
+    return {
+        "version": STATE_VERSION,
+        "mapping": mapping_hash(general_mapping),
+        "templates": [list(map(str, t.columns)) for t in (general_template, reqdoc_template, specialty_template)],
+        "columns": list(map(str, allied.columns))
+    }
+
+def _mark_normalized(df):
+    # Saved outputs were normalized; the flag doesn't survive the file, so set it again
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].array
+        if values.dtype == "string":
+            mark_str_normalized(values)
+    return df
+
+def load_state(state_dir, signature):
+    """
+    Return (previous row hashes as a Series indexed by worker key, previous tagged outputs)
+    or (None, None) if there is no usable state for this signature.
+    """
+    state_path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return None, None
+    with open(state_path, encoding="utf-8") as f:
+        if json.load(f) != signature:
+            return None, None
+    previous = pd.read_pickle(os.path.join(state_dir, HASHES_FILE))
+    # Read into memory rather than mapped, so save_state can replace the files afterwards
+    outputs = [_mark_normalized(read_frame(os.path.join(state_dir, name), memory_map=False)) for name in OUTPUT_FILES]
+    return previous, outputs
+
+def save_state(state_dir, signature, keys, hashes, outputs):
+    """
+    Write the signature, per-worker hashes and tagged full outputs for the next run.
+    Outputs given as None are unchanged and left as they are on disk.
+    Crash-safe: state.json is removed first and written last, so a run interrupted in between finds
+    no usable state (and does a full run) instead of pairing the old signature with new files.
+    Every file is written to a temporary name and moved into place.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    hashes_path = os.path.join(state_dir, HASHES_FILE)
+    pd.Series(hashes, index=pd.Index(keys.astype(object))).to_pickle(hashes_path + ".tmp")
+    os.replace(hashes_path + ".tmp", hashes_path)
+    for name, df in zip(OUTPUT_FILES, outputs):
+        if df is not None:
+            path = os.path.join(state_dir, name)
+            write_frame(df, path + ".tmp")
+            os.replace(path + ".tmp", path)
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(signature, f)
+    os.replace(state_path + ".tmp", state_path)
+
+def _with_tags(df, tags):
+    df = df.copy(deep=False)
+    df.insert(0, KEY_COLUMN, np.asarray(tags, dtype=np.int64))
+    return df
+
+def _tag_outputs(results, positions, subset_keys):
+    """
+    Tag freshly derived outputs with their worker's position in the export (positions holds one per
+    subset row). Returns None if a Person_key doesn't match its worker's Id key.
+    """
+    general, reqdoc_df, specialty_df = results
+    tagged = [_with_tags(general, positions if len(general) == len(positions) else positions[:0])]
+    lookup = pd.Index(subset_keys.astype(object))
+    for df in (reqdoc_df, specialty_df):
+        found = lookup.get_indexer(df["Person_key"].astype(object)) if len(df) else np.array([], dtype=np.int64)
+        if (found == -1).any():
+            return None
+        tagged.append(_with_tags(df, positions[found]))
+    return tagged
+
+def _untag(df):
+    keep = [i for i, column in enumerate(df.columns) if column != KEY_COLUMN]
+    out = pd.DataFrame({i: df.iloc[:, i].array for i in keep}, index=pd.RangeIndex(len(df)), copy=False)
+    out.columns = df.columns[keep]
+    return ensure_str_columns(out)
+
+def _concat_rows(frames):
+    """Stack frames with the same columns, keeping compacted text columns compact."""
+    arrays = {}
+    for i in range(frames[0].shape[1]):
+        parts = [df.iloc[:, i].array for df in frames]
+        if any(isinstance(part, pd.Categorical) for part in parts):
+            # Union the categories instead of falling back to object; plain text parts are categorized first
+            parts = [part if isinstance(part, pd.Categorical) else compact_str_values(part, max_ratio=1)
+                     for part in parts]
+            arrays[i] = mark_str_normalized(union_categoricals(parts))
+        else:
+            values = pd.concat([pd.Series(part, copy=False) for part in parts], ignore_index=True).array
+            arrays[i] = mark_str_normalized(values) if values.dtype == "string" else values
+    out = pd.DataFrame(arrays, copy=False)
+    out.columns = frames[0].columns
+    return out
+
+def _merge(previous_df, fresh_df, moved):
+    """
+    Keep the previous rows of unchanged workers (renumbered by moved, their previous -> current
+    position, -1 for dropped workers), add the fresh rows, and order rows like a full run.
+    """
+    positions = moved[previous_df[KEY_COLUMN].to_numpy()]
+    keep = positions >= 0
+    kept = previous_df.iloc[np.flatnonzero(keep)] if not keep.all() else previous_df.copy(deep=False)
+    kept.isetitem(kept.columns.get_loc(KEY_COLUMN), positions[keep])
+    # Empty frames are skipped (concat warns about them and they add nothing)
+    frames = [df for df in (kept, fresh_df) if len(df)]
+    if not frames:
+        return fresh_df
+    merged = frames[0] if len(frames) == 1 else _concat_rows(frames)
+    tags = merged[KEY_COLUMN].to_numpy()
+    if (tags[1:] < tags[:-1]).any():
+        # A worker's rows are either all kept or all fresh, so a stable sort keeps their order
+        merged = merged.take(np.argsort(tags, kind="stable"))
+    return merged.reset_index(drop=True)
+
+def _full_run(allied, general_template, reqdoc_template, specialty_template, general_mapping):
+    results = run_pipeline(allied, general_template, reqdoc_template, specialty_template, general_mapping)
+    return {"full": results, "delta": results, "removed": [],
+            "stats": {"added": len(allied), "changed": 0, "removed": 0, "unchanged": 0, "incremental": False}}
+
+def run_delta(allied, general_template, reqdoc_template, specialty_template, general_mapping, state_dir):
+    """
+    Convert an Allied export incrementally against the state in state_dir, then update that state.
+    Falls back to a full run when Ids are missing/duplicated, Person_key is not in the
+    Required Docs/Specialty templates or doesn't match the Ids, or the templates/mapping changed
+    since the last run.
+    Returns: dict with "full" (general, reqdoc, specialty), "delta" (rows of added/changed workers),
+    "removed" (Person_keys no longer present) and "stats" (worker counts).
+    """
+    templates = (general_template, reqdoc_template, specialty_template)
+    keys = worker_keys(allied)
+    signature = _run_signature(*templates, general_mapping, allied)
+    keyed = keys is not None and all("Person_key" in t.columns for t in (reqdoc_template, specialty_template))
+    if not keyed:
+        return _full_run(allied, *templates, general_mapping)
+    previous, previous_outputs = load_state(state_dir, signature)
+
+    hashes = row_hashes(allied)
+    if previous is None:
+        previous, previous_outputs = pd.Series([], dtype="uint64", index=pd.Index([], dtype=object)), None
+    # Positional lookup keeps the hashes exact (a dict map would go through float on misses)
+    found = previous.index.get_indexer(keys.astype(object))
+    is_new = found == -1
+    old_hashes = previous.to_numpy()[found[~is_new]]
+    is_changed = np.zeros(len(keys), dtype=bool)
+    is_changed[~is_new] = old_hashes != hashes[~is_new]
+    rederive = is_new | is_changed
+    present = np.zeros(len(previous), dtype=bool)
+    present[found[~is_new]] = True
+    removed = previous.index[~present].tolist()
+    # Current position of each previous worker whose rows are kept as they are (-1: changed or removed)
+    moved = np.full(len(previous), -1, dtype=np.int64)
+    moved[found[~rederive]] = np.flatnonzero(~rederive)
+
+    subset = allied[rederive]
+    fresh = _tag_outputs(
+        run_pipeline(subset, *templates, general_mapping), np.flatnonzero(rederive), keys[rederive]
+    )
+    if fresh is None:
+        return _full_run(allied, *templates, general_mapping)
+    if previous_outputs is None:
+        merged, changed = fresh, fresh
+    else:
+        merged, changed = [], []
+        for prev, new in zip(previous_outputs, fresh):
+            tags = prev[KEY_COLUMN].to_numpy()
+            # Untouched outputs (no fresh or dropped rows, nobody moved) are reused and not rewritten
+            same = not len(new) and np.array_equal(moved[tags], tags)
+            merged.append(prev if same else _merge(prev, new, moved))
+            changed.append(None if same else merged[-1])
+    unchanged_run = not rederive.any() and not removed and np.array_equal(found, np.arange(len(keys)))
+    if not unchanged_run:
+        save_state(state_dir, signature, keys, hashes, changed)
+    return {
+        "full": tuple(_untag(df) for df in merged),
+        "delta": tuple(_untag(df) for df in fresh),
+        "removed": removed,
+        "stats": {"added": int(is_new.sum()), "changed": int(is_changed.sum()), "removed": len(removed),
+                  "unchanged": int((~rederive).sum()), "incremental": previous_outputs is not None}
+    }
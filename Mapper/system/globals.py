@@ -1,8 +1,4 @@
-import streamlit as st
-import pandas as pd
 import logging
-import io
-import zipfile
 
 # --- CONFIGURATION & GLOBALS ---
 
@@ -36,5 +32,11 @@ ALLIED_SPECIALTIES = [
 ]
 
 # --- LOGGING SETUP ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+
+def configure_logging():
+    """
+    Send INFO logs to stderr. Called by the entry points (the app and batch CLI) rather than on import,
+    so importing the processing modules leaves logging untouched.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
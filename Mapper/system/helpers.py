@@ -1,17 +1,8 @@
-import streamlit as st
-import pandas as pd
+from importlib.util import find_spec
 import numpy as np
+import pandas as pd
 import re
-
-def reset_processing():
-    """
-    Reset all Streamlit session state variables to allow a new mapping and processing run.
-    """
-    st.session_state.processed = False
-    st.session_state.general_df = None
-    st.session_state.reqdoc_df = None
-    st.session_state.specialty_df = None
-    # No license_df needed for Allied
+from setup import CATEGORY_MAX_RATIO
 
 def clean_text(text: str) -> str:
     """
@@ -23,11 +14,118 @@ def clean_text(text: str) -> str:
     text = re.sub(r"\s+", " ", text)
     return text.strip()
 
-def ensure_str_columns(df):
-    """Convert all columns in DataFrame to strings, blanking out missing values and weird types."""
-    df = df.copy()
-    for col in df.columns:
-        df[col] = df[col].astype(str)
-        df[col] = df[col].replace(['nan', 'NaT', '<NA>', 'None', 'none', 'NULL', 'null'], '', regex=False)
-        df[col] = df[col].replace({np.nan: '', None: ''})
-    return df
+# Text that counts as missing once a value has been converted to a string
+MISSING_STRINGS = ['nan', 'NaT', '<NA>', 'None', 'none', 'NULL', 'null']
+
+# Flag set on arrays built by normalize_str_values, so checking them again is O(1)
+NORMALIZED_FLAG = "_str_normalized"
+
+def mark_str_normalized(values):
+    """Flag a `string` array as normalized (no missing values) and return it."""
+    setattr(values, NORMALIZED_FLAG, True)
+    return values
+
+def is_str_normalized(series):
+    """
+    True if a column is already pandas `string` dtype with no missing values or null-like text
+    (see MISSING_STRINGS), or a compacted categorical of such strings (see compact_str_columns).
+    Arrays flagged by mark_str_normalized are trusted without scanning their values.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if series.dtype.categories.dtype != "string":
+            return False
+        if getattr(series.array, NORMALIZED_FLAG, False):
+            return True
+        return not (series.array.codes == -1).any() and not series.dtype.categories.isin(MISSING_STRINGS).any()
+    if series.dtype != "string":
+        return False
+    if getattr(series.array, NORMALIZED_FLAG, False):
+        return True
+    return not series.hasnans and not series.isin(MISSING_STRINGS).any()
+
+def normalize_str_values(series):
+    """
+    Convert a column to a pandas `string` array with missing values and
+    null-like text (see MISSING_STRINGS) blanked out.
+    """
+    values = series.astype(str).to_numpy(dtype=object, copy=True)
+    values[pd.Series(values).isin(MISSING_STRINGS).to_numpy()] = ''
+    return mark_str_normalized(pd.array(values, dtype="string", copy=False))
+
+# Compacted text is held in Arrow buffers when pyarrow is available (it ships with Streamlit)
+COMPACT_STRING_DTYPE = "string[pyarrow]" if find_spec("pyarrow") else "string"
+
+# Rows looked at to spot near-unique columns before factorizing all of them
+COMPACT_SAMPLE_ROWS = 10_000
+
+def compact_str_values(values, max_ratio=CATEGORY_MAX_RATIO):
+    """
+    Return a normalized `string` array in a compact form with the same values:
+    a Categorical (integer codes + one copy of each distinct string) if it has at most
+    max_ratio distinct values per row, otherwise (with pyarrow) one Arrow string buffer.
+    """
+    if not len(values):
+        return values
+    # Normalized arrays have no missing values, so the object ndarray can be hashed directly
+    objects = np.asarray(values, dtype=object)
+    sample = objects[:COMPACT_SAMPLE_ROWS]
+    codes = uniques = None
+    if len(pd.unique(sample)) <= max_ratio * len(sample):
+        codes, uniques = pd.factorize(objects)
+    if uniques is None or len(uniques) > max_ratio * len(values):
+        if COMPACT_STRING_DTYPE == "string":
+            return values
+        return mark_str_normalized(pd.array(objects, dtype=COMPACT_STRING_DTYPE))
+    dtype = pd.CategoricalDtype(pd.Index(uniques, dtype=COMPACT_STRING_DTYPE))
+    return mark_str_normalized(pd.Categorical.from_codes(codes, dtype=dtype))
+
+def compact_str_columns(df, max_ratio=CATEGORY_MAX_RATIO):
+    """
+    Store the text columns of a normalized frame compactly (see compact_str_values).
+    Values (and CSV output) are unchanged; repeated strings are held once instead of once per row.
+    """
+    arrays = {}
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        arrays[i] = compact_str_values(series.array, max_ratio) if series.dtype == "string" else series.array
+    out = pd.DataFrame(arrays, index=df.index, copy=False)
+    out.columns = df.columns
+    return out
+
+def _object_values(values):
+    if isinstance(values, pd.Categorical):
+        # Convert each category once and index it by code (code -1, missing, picks the appended None)
+        return np.append(np.asarray(values.categories, dtype=object), None)[values.codes]
+    return np.asarray(values, dtype=object)
+
+def expand_str_columns(df):
+    """
+    Undo compact_str_columns for writing: compacted columns become plain object arrays.
+    to_csv formats those much faster than Categorical or Arrow columns.
+    """
+    if not any(isinstance(dtype, pd.CategoricalDtype) or dtype == COMPACT_STRING_DTYPE for dtype in df.dtypes):
+        return df
+    out = pd.DataFrame({i: _object_values(df.iloc[:, i].array) for i in range(df.shape[1])},
+                       index=df.index, copy=False)
+    out.columns = df.columns
+    return out
+
+def ensure_str_columns(df, inplace=False):
+    """
+    Convert all columns in DataFrame to strings, blanking out missing values and weird types.
+    Columns that are already normalized are left untouched (and shared, not copied).
+    With inplace=True the columns of `df` are replaced and `df` itself is returned.
+    """
+    if inplace:
+        for i in range(df.shape[1]):
+            series = df.iloc[:, i]
+            if not is_str_normalized(series):
+                df.isetitem(i, normalize_str_values(series))
+        return df
+    arrays = {}
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        arrays[i] = series.array if is_str_normalized(series) else normalize_str_values(series)
+    out = pd.DataFrame(arrays, index=df.index, copy=False)
+    out.columns = df.columns
+    return out
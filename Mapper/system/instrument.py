@@ -0,0 +1,197 @@
+# instrument.py
+"""
+Lightweight pipeline instrumentation: per-stage wall time, row counts and memory.
+
+Stages are recorded into the active PerfRecorder (see `recording`); with none active,
+`stage` is a no-op, so library code can be instrumented unconditionally.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+import pandas as pd
+from globals import logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LOG_EVENT = "pipeline_stage"
+MB = 1024 * 1024
+
+_active = ContextVar("perf_recorder", default=None)
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return round(peak / MB if sys.platform == "darwin" else peak / 1024, 1)
+
+class PerfRecorder:
+    """
+    Collects one record per stage run: name, seconds, rows in/out, peak RSS and,
+    while tracemalloc is tracing, the peak Python allocation during the stage.
+    Records are logged as JSON lines once flush_logs() has been called (immediately if live=True).
+    """
+
+    def __init__(self, live=False):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.records = []
+        self.live = live
+        self._logged = 0
+        self._peaks = []
+
+    def add(self, record):
+        self.records.append(record)
+        if self.live:
+            self.flush_logs()
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def flush_logs(self):
+        """Log every record not logged yet as a JSON line, then log new records as they arrive."""
+        for record in self.records[self._logged:]:
+            logger.info(json.dumps({"event": LOG_EVENT, "run": self.run_id, **record}))
+        self._logged = len(self.records)
+        self.live = True
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Time the enclosed block as one stage. Yields the record, so the block can set "rows_out".
+        Nested stages are supported; allocation peaks of inner stages count toward the outer one.
+        """
+        record = {"stage": name, "seconds": None, "rows_in": rows_in, "rows_out": None,
+                  "rss_peak_mb": None, "rss_growth_mb": None, "alloc_peak_mb": None}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            alloc_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        rss_start = peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            record["rss_peak_mb"] = peak_rss_mb()
+            if rss_start is not None:
+                record["rss_growth_mb"] = round(record["rss_peak_mb"] - rss_start, 1)
+            if tracing and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+                record["alloc_peak_mb"] = round((peak - alloc_start) / MB, 2)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            self.add(record)
+
+    def summary(self):
+        """Records aggregated by stage name, in first-seen order (sharded stages add up)."""
+        if not self.records:
+            return pd.DataFrame(columns=["stage", "calls", "seconds", "rows_in", "rows_out",
+                                         "rss_peak_mb", "alloc_peak_mb"])
+        df = pd.DataFrame(self.records)
+        total = lambda values: values.sum(min_count=1)
+        grouped = df.groupby("stage", sort=False).agg(
+            calls=("seconds", "size"),
+            seconds=("seconds", "sum"),
+            rows_in=("rows_in", total),
+            rows_out=("rows_out", total),
+            rss_peak_mb=("rss_peak_mb", "max"),
+            alloc_peak_mb=("alloc_peak_mb", "max")
+        )
+        return grouped.reset_index()
+
+@contextmanager
+def recording(recorder):
+    """Make recorder the target of `stage` for the enclosed block (in this thread)."""
+    token = _active.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active.reset(token)
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Record the enclosed block in the active recorder, if any. Yields a dict for "rows_out"."""
+    recorder = _active.get()
+    if recorder is None:
+        yield {}
+        return
+    with recorder.stage(name, rows_in) as record:
+        yield record
+
+def record_all(records):
+    """Add records produced elsewhere (e.g. in a worker process) to the active recorder."""
+    recorder = _active.get()
+    if recorder is not None:
+        recorder.extend(records)
+
+def measured(trace_memory, fn, *args):
+    """
+    Call fn(*args) with a fresh recorder active and return (result, records).
+    Used to run instrumented stages in pool workers, which do not share the caller's recorder.
+    """
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        with recording(PerfRecorder()) as recorder:
+            result = fn(*args)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return result, recorder.records
+
+@contextmanager
+def tracing_memory(enabled=True):
+    """Run the enclosed block with tracemalloc on, so stages report allocation peaks (slows Python code)."""
+    started = enabled and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if started:
+            tracemalloc.stop()
+
+@contextmanager
+def profiled(enabled=True, top=30):
+    """
+    Run the enclosed block under cProfile. Yields a dict that receives, on exit,
+    "dump" (pstats file bytes, loadable with snakeviz/pstats) and "text" (top functions by cumulative time).
+    Only this process is profiled; work done in worker processes shows up as waiting.
+    """
+    result = {}
+    if not enabled:
+        yield result
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        fd, path = tempfile.mkstemp(suffix=".prof")
+        os.close(fd)
+        try:
+            profiler.dump_stats(path)
+            with open(path, "rb") as f:
+                result["dump"] = f.read()
+        finally:
+            os.remove(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+        result["text"] = text.getvalue()
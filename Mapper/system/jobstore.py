@@ -0,0 +1,244 @@
+# jobstore.py
+"""
+On-disk store for processed outputs, keyed by job ID.
+
+Each job is a directory holding one uncompressed Arrow IPC file per output (plus any CSV/ZIP
+exported from it), indexed in a SQLite database. Outputs are memory-mapped back on load, so
+previews and downloads read pages from the OS file cache instead of every session holding its
+own copy, and any process pointed at the same directory can open a job by its ID. Jobs unused
+for longer than the TTL are evicted, then the least recently used ones until the store fits its
+size budget.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from setup import JOB_STORE_DIR, JOB_STORE_MAX_BYTES, JOB_STORE_TTL_SECONDS, JOB_STORE_OPEN_JOBS
+from helpers import mark_str_normalized
+
+INDEX_FILE = "jobs.sqlite"
+OUTPUT_SUFFIX = ".arrow"
+
+def _is_text(arrow_type):
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+
+def _column_array(column):
+    """pandas array for one Arrow column, without copying string data out of the mapped file."""
+    if pa.types.is_dictionary(column.type) and _is_text(column.type.value_type):
+        # Written from a compacted Categorical: rebuild it over Arrow-backed categories
+        chunks = column.chunks
+        categories = chunks[0].dictionary if chunks else pa.array([], type=column.type.value_type)
+        codes = [chunk.indices.fill_null(-1).to_numpy(zero_copy_only=False) for chunk in chunks]
+        codes = np.concatenate(codes) if codes else np.array([], dtype=np.int8)
+        dtype = pd.CategoricalDtype(pd.Index(pd.arrays.ArrowStringArray(categories)))
+        return mark_str_normalized(pd.Categorical.from_codes(codes, dtype=dtype))
+    if _is_text(column.type):
+        return pd.arrays.ArrowStringArray(column)
+    return column.to_pandas().array
+
+def write_frame(df, path):
+    """Write a DataFrame as an uncompressed Arrow IPC file (the index is not kept)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def read_frame(path, memory_map=True):
+    """
+    Read an Arrow IPC file written by write_frame back into a DataFrame, memory-mapped unless
+    memory_map=False (then the file is read into memory and can be replaced while the frame is in use).
+    """
+    if memory_map:
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    else:
+        with pa.OSFile(path, "rb") as source:
+            table = pa.ipc.open_file(source).read_all()
+    # Dictionaries may differ between record batches; unify them so each column has one set of categories
+    table = table.unify_dictionaries()
+    df = pd.DataFrame({i: _column_array(column) for i, column in enumerate(table.columns)}, copy=False)
+    df.columns = table.column_names
+    return df
+
+class JobStore:
+    """
+    Processed outputs saved under job IDs in a local directory, with TTL and size-based eviction.
+    Safe to share between threads and processes; loaded jobs are kept open (memory-mapped) in a
+    small per-process LRU so reruns get the same frames back.
+    """
+
+    def __init__(self, directory=JOB_STORE_DIR, max_bytes=JOB_STORE_MAX_BYTES, ttl_seconds=JOB_STORE_TTL_SECONDS,
+                 open_jobs=JOB_STORE_OPEN_JOBS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.open_jobs = open_jobs
+        self._opened = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL, meta TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation: sqlite3 connections can't be shared across threads
+        db = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def path_for(self, job_id):
+        """Directory holding a job's files (also where exports of the job are cached)."""
+        return os.path.join(self.directory, job_id)
+
+    def save(self, outputs, meta=None):
+        """
+        Write {output name: DataFrame} as a new job, then evict old jobs to stay within the limits.
+        meta: optional JSON-serializable details kept with the job.
+        Returns: the new job ID.
+        """
+        job_id = uuid.uuid4().hex
+        staging = os.path.join(self.directory, f".{job_id}.tmp")
+        os.makedirs(staging)
+        try:
+            names = []
+            for index, (name, df) in enumerate(outputs.items()):
+                write_frame(df, os.path.join(staging, f"{index}{OUTPUT_SUFFIX}"))
+                names.append(name)
+            # Readers only ever see complete jobs: the directory appears in one rename
+            os.replace(staging, self.path_for(job_id))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._register(job_id, names, meta)
+        return job_id
+
+    def create(self, meta=None):
+        """
+        Register a new job with no outputs, for callers that write their own files into its
+        directory (path_for). It expires and is evicted like any other job; load() returns {} for it.
+        Returns: the new job ID.
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.path_for(job_id))
+        self._register(job_id, [], meta)
+        return job_id
+
+    def _register(self, job_id, names, meta):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, created, accessed, meta) VALUES (?, ?, ?, ?)",
+                (job_id, now, now, json.dumps({"outputs": names, **(meta or {})}, default=str))
+            )
+        self.evict(keep=job_id)
+
+    def _record(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT created, accessed, meta FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row
+
+    def meta(self, job_id):
+        """The meta dict saved with a job (including "outputs", the output names), or None if it is gone."""
+        row = self._record(job_id)
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return json.loads(row[2])
+
+    def load(self, job_id):
+        """
+        Return {output name: DataFrame} for a job, memory-mapped from disk, or None if it is unknown or expired.
+        The frames are shared with other callers in this process and must be treated as read-only.
+        """
+        if not job_id:
+            return None
+        meta = self.meta(job_id)
+        if meta is None:
+            return None
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET accessed = ? WHERE id = ?", (time.time(), job_id))
+        with self._lock:
+            if job_id in self._opened:
+                self._opened.move_to_end(job_id)
+                return self._opened[job_id]
+        try:
+            outputs = {
+                name: read_frame(os.path.join(self.path_for(job_id), f"{index}{OUTPUT_SUFFIX}"))
+                for index, name in enumerate(meta["outputs"])
+            }
+        except (OSError, pa.ArrowInvalid):
+            # Evicted by another process between the lookup and the read
+            return None
+        with self._lock:
+            self._opened[job_id] = outputs
+            while len(self._opened) > self.open_jobs:
+                self._opened.popitem(last=False)
+        return outputs
+
+    def delete(self, job_id):
+        """Remove a job and its files."""
+        with self._connect() as db:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        with self._lock:
+            self._opened.pop(job_id, None)
+        # Files still mapped elsewhere can't be removed on Windows; eviction retries them later
+        shutil.rmtree(self.path_for(job_id), ignore_errors=True)
+
+    def job_bytes(self, job_id):
+        """Bytes on disk used by a job, including its cached exports."""
+        path = self.path_for(job_id)
+        if not os.path.isdir(path):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def evict(self, keep=None, now=None):
+        """
+        Delete jobs not accessed within the TTL, then the least recently used ones until the store
+        fits in max_bytes. The job `keep` (e.g. the one just saved) is never evicted.
+        Returns: IDs of the evicted jobs.
+        """
+        now = time.time() if now is None else now
+        with self._connect() as db:
+            jobs = db.execute("SELECT id, accessed FROM jobs ORDER BY accessed").fetchall()
+        evicted = [job_id for job_id, accessed in jobs if job_id != keep and now - accessed > self.ttl_seconds]
+        remaining = [job_id for job_id, _ in jobs if job_id not in evicted]
+        sizes = {job_id: self.job_bytes(job_id) for job_id in remaining}
+        total = sum(sizes.values())
+        for job_id in remaining:
+            if total <= self.max_bytes:
+                break
+            if job_id != keep:
+                evicted.append(job_id)
+                total -= sizes[job_id]
+        for job_id in evicted:
+            self.delete(job_id)
+        self._remove_orphans({job_id for job_id, _ in jobs}, now)
+        return evicted
+
+    def _remove_orphans(self, known, now):
+        # Directories without an index row: interrupted saves, or deletes that failed earlier
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.lstrip(".").removesuffix(".tmp") in known:
+                continue
+            if now - entry.stat().st_mtime > self.ttl_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+_default_store = None
+
+def default_store():
+    """The process-wide JobStore on JOB_STORE_DIR (created on first use)."""
+    global _default_store
+    if _default_store is None:
+        _default_store = JobStore()
+    return _default_store
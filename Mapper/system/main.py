@@ -1,12 +1,17 @@
 import streamlit as st
-import pandas as pd
 import traceback
-import io, zipfile
-from setup import REQUIRED_DEFAULTS
-from helpers import reset_processing, ensure_str_columns
-from mapping import get_mapping, apply_mapping
-from processing import process_general_info, process_required_docs, process_specialties
-from ui_helpers import display_data_with_controls, preview_keap_data
+from pipeline import STAGES
+from validation import validate_outputs
+from cache import read_excel_cached, read_template_cached, run_pipeline_cached, save_result_cached
+from jobstore import default_store
+from instrument import PerfRecorder, recording, stage, tracing_memory, profiled
+from globals import configure_logging
+from ui_helpers import (
+    reset_processing, get_mapping, preview_keap_data, profile_loader, profile_saver, performance_panel,
+    batch_options, run_batch, batch_results_view, results_view
+)
+
+configure_logging()
 
 st.set_page_config(
     page_title="Allied Data Mapper",
@@ -17,14 +22,19 @@ st.set_page_config(
 # --- SESSION STATE ---
 if "processed" not in st.session_state:
     st.session_state.processed = False
-if "general_df" not in st.session_state:
-    st.session_state.general_df = None
-if "reqdoc_df" not in st.session_state:
-    st.session_state.reqdoc_df = None
-if "specialty_df" not in st.session_state:
-    st.session_state.specialty_df = None
+# Processed outputs live in the on-disk job store; the session keeps only the job ID
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
 if "keap_df" not in st.session_state:  # You can call this "allied_df" if you like
     st.session_state.keap_df = None
+if "perf" not in st.session_state:
+    st.session_state.perf = None
+if "perf_profile" not in st.session_state:
+    st.session_state.perf_profile = None
+if "batch_result" not in st.session_state:
+    st.session_state.batch_result = None
+if "validation" not in st.session_state:
+    st.session_state.validation = None
 
 st.title("💺 Allied Data Mapper App")
 st.markdown("Upload your excel export, templates to map, and map fields before generating CSVs.")
@@ -32,8 +42,12 @@ st.markdown("Upload your excel export, templates to map, and map fields before g
 # --- FILE UPLOADS ---
 col1, col2 = st.columns(2)
 with col1:
-    st.markdown('<p class="upload-text">📅 Upload Allied Excel file</p>', unsafe_allow_html=True)
-    allied_file = st.file_uploader("Allied Excel file", type="xlsx", key="allied_file", label_visibility="collapsed")
+    st.markdown('<p class="upload-text">📅 Upload Allied Excel file(s)</p>', unsafe_allow_html=True)
+    allied_files = st.file_uploader(
+        "Allied Excel file", type="xlsx", key="allied_file", accept_multiple_files=True, label_visibility="collapsed"
+    )
+    # Several exports are converted as one batch with the mapping made on the first
+    allied_file = allied_files[0] if allied_files else None
 with col2:
     st.markdown('<p class="upload-text">📄 BlueSky <span class="special-text">Caregiver General Info</span> Template</p>', unsafe_allow_html=True)
     bs_general = st.file_uploader("General Info Template", type="csv", key="bs_general", label_visibility="collapsed")
@@ -42,104 +56,118 @@ with col2:
     st.markdown('<p class="upload-text">📄 BlueSky <span class="special-text">Caregiver Specialty</span> Template</p>', unsafe_allow_html=True)
     bs_specialty = st.file_uploader("Specialty Template", type="csv", key="bs_specialty", label_visibility="collapsed")
 
-def clean_cols(df: pd.DataFrame) -> pd.DataFrame:
-    df.columns = [c.replace("*", "").strip() for c in df.columns]
-    return df
+# A job ID in the URL (set after processing) reopens the stored results after a reload or restart
+saved_job = st.query_params.get("job")
+uploaded = all([allied_file, bs_general, bs_reqdoc, bs_specialty])
+saved_outputs = default_store().load(saved_job) if saved_job and not uploaded else None
 
-if all([allied_file, bs_general, bs_reqdoc, bs_specialty]):
+if uploaded:
     if st.session_state.processed:
         if st.button("Reset & Start New Mapping", type="secondary"):
             reset_processing()
             st.rerun()
     if not st.session_state.processed:
+        # Timings of this rerun; kept (and logged) only if it ends up processing the data
+        perf = PerfRecorder()
         try:
-            allied = pd.read_excel(allied_file)
-            general_template = clean_cols(pd.read_csv(bs_general))
-            reqdoc_template = clean_cols(pd.read_csv(bs_reqdoc))
-            specialty_template = clean_cols(pd.read_csv(bs_specialty))
+            # Parsed frames are cached by upload content, so reruns with unchanged files skip parsing
+            with recording(perf):
+                allied, allied_hash = read_excel_cached(allied_file)
+                general_template, general_hash = read_template_cached(bs_general)
+                reqdoc_template, reqdoc_hash = read_template_cached(bs_reqdoc)
+                specialty_template, specialty_hash = read_template_cached(bs_specialty)
             st.session_state.keap_df = allied
             st.success(f"✅ Loaded Allied data with {len(allied)} records and {len(allied.columns)} columns")
+            if len(allied_files) > 1:
+                st.info(
+                    f"📚 {len(allied_files)} Allied files uploaded: map the fields using {allied_file.name}; "
+                    "the same templates and mapping are applied to every file."
+                )
             with st.expander("Preview Allied Data", expanded=False):
                 preview_keap_data(allied)
             st.subheader("🤩 Data Mapping")
+            templates = {
+                "General Info": general_template,
+                "Required Docs": reqdoc_template,
+                "Specialty": specialty_template
+            }
+            profile_loader(templates, allied)
             tab1, tab2, tab3 = st.tabs(["General Info", "Required Docs", "Specialty"])
-            with tab1:
-                general_mapping = get_mapping(general_template, allied, "General Info")
-            with tab2:
-                reqdoc_mapping = get_mapping(reqdoc_template, allied, "Required Docs")
-            with tab3:
-                specialty_mapping = get_mapping(specialty_template, allied, "Specialty")
+            with recording(perf):
+                with tab1, stage("get_mapping:General Info"):
+                    general_mapping = get_mapping(general_template, allied, "General Info")
+                with tab2, stage("get_mapping:Required Docs"):
+                    reqdoc_mapping = get_mapping(reqdoc_template, allied, "Required Docs")
+                with tab3, stage("get_mapping:Specialty"):
+                    specialty_mapping = get_mapping(specialty_template, allied, "Specialty")
+            profile_saver(templates, {
+                "General Info": general_mapping,
+                "Required Docs": reqdoc_mapping,
+                "Specialty": specialty_mapping
+            })
             st.subheader("🔄 Process Data")
+            if len(allied_files) > 1:
+                batch_mode, batch_dedupe = batch_options()
             if st.button("Process and Generate CSVs", type="primary"):
+                if len(allied_files) > 1:
+                    st.session_state.batch_result = run_batch(
+                        allied_files, templates, general_mapping, batch_mode, batch_dedupe
+                    )
+                    st.session_state.processed = True
+                    st.rerun()
                 with st.spinner("Processing data..."):
-                    general = apply_mapping(general_template, general_mapping, allied)
-                    for field, default in REQUIRED_DEFAULTS.items():
-                        if field in general.columns:
-                            general[field] = general[field].fillna(default).replace("", default)
-                    reqdoc_df = process_required_docs(allied, reqdoc_template)
-                    specialty_df = process_specialties(allied, specialty_template)
-                    st.session_state.general_df = ensure_str_columns(general)
-                    st.session_state.reqdoc_df = ensure_str_columns(reqdoc_df)
-                    st.session_state.specialty_df = ensure_str_columns(specialty_df)
+                    stage_bars = {name: st.progress(0.0, text=f"{name}: queued") for name in STAGES}
+                    def report_progress(name, done, total):
+                        stage_bars[name].progress(done / total, text=f"{name}: {done}/{total} parts done")
+                    with recording(perf), tracing_memory(st.session_state.get("perf_tracemalloc", False)), \
+                            profiled(st.session_state.get("perf_cprofile", False)) as profile, \
+                            stage("pipeline", rows_in=len(allied)) as record:
+                        general, reqdoc_df, specialty_df = run_pipeline_cached(
+                            allied, general_template, reqdoc_template, specialty_template, general_mapping,
+                            (allied_hash, general_hash, reqdoc_hash, specialty_hash),
+                            progress=report_progress
+                        )
+                        record["rows_out"] = len(general) + len(reqdoc_df) + len(specialty_df)
+                    # Unchanged inputs reuse the job (and validation report) saved by the earlier click
+                    with recording(perf), stage("save_job", rows_in=record["rows_out"]):
+                        st.session_state.job_id, st.session_state.validation = save_result_cached(
+                            dict(zip(STAGES, (general, reqdoc_df, specialty_df))),
+                            (allied_hash, general_hash, reqdoc_hash, specialty_hash), general_mapping,
+                            {"allied_file": allied_file.name, "allied_rows": len(allied)}
+                        )
+                    perf.flush_logs()
+                    st.session_state.perf = perf
+                    st.session_state.perf_profile = profile or None
+                    # The job ID in the URL lets a reload (or another app instance) reopen the results
+                    st.query_params["job"] = st.session_state.job_id
                     st.session_state.processed = True
                     st.rerun()
+            performance_panel(perf, st.session_state.perf_profile)
         except Exception as e:
             st.error(f"Error processing data: {str(e)}")
             st.info("See the server/terminal log for the full error details.")
             traceback.print_exc()
+    elif st.session_state.batch_result is not None:
+        batch_results_view(st.session_state.batch_result)
     else:
-        if (st.session_state.general_df is not None and 
-            st.session_state.reqdoc_df is not None and
-            st.session_state.specialty_df is not None):
-            st.subheader("🔍 Data Preview")
-            preview_tabs = st.tabs(["General Info", "Required Docs", "Specialty Info"])
-            with preview_tabs[0]:
-                display_data_with_controls(st.session_state.general_df, "general", "general")
-            with preview_tabs[1]:
-                display_data_with_controls(st.session_state.reqdoc_df, "certification", "reqdoc")
-            with preview_tabs[2]:
-                display_data_with_controls(st.session_state.specialty_df, "specialty", "specialty")
-            st.subheader("📄 Download Transformed Files")
-            col1, col2 = st.columns(2)
-            with col1:
-                st.download_button(
-                    "Download Caregiver General Info", 
-                    st.session_state.general_df.to_csv(index=False).encode(), 
-                    "BlueSky_Caregiver_General_Info.csv", 
-                    "text/csv"
-                )
-                st.download_button(
-                    "Download Caregiver Required Docs", 
-                    st.session_state.reqdoc_df.to_csv(index=False).encode(), 
-                    "BlueSky_Caregiver_RequiredDocs_Info.csv", 
-                    "text/csv"
-                )
-                st.download_button(
-                    "Download Caregiver Specialty Info", 
-                    st.session_state.specialty_df.to_csv(index=False).encode(), 
-                    "BlueSky_Caregiver_Specialty_Info.csv", 
-                    "text/csv"
-                )
-            with col2:
-                def create_zip_with_csvs():
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED) as zip_file:
-                        zip_file.writestr("BlueSky_Caregiver_General_Info.csv", 
-                                          st.session_state.general_df.to_csv(index=False))
-                        zip_file.writestr("BlueSky_Caregiver_RequiredDocs_Info.csv", 
-                                          st.session_state.reqdoc_df.to_csv(index=False))
-                        zip_file.writestr("BlueSky_Caregiver_Specialty_Info.csv", 
-                                          st.session_state.specialty_df.to_csv(index=False))
-                    return zip_buffer.getvalue()
-                st.download_button(
-                    "💾 Download All Files (ZIP)",
-                    create_zip_with_csvs(),
-                    "BlueSky_All_Files.zip",
-                    "application/zip"
-                )
+        outputs = default_store().load(st.session_state.job_id)
+        if outputs is not None:
+            results_view(
+                st.session_state.job_id, outputs, st.session_state.validation,
+                st.session_state.perf, st.session_state.perf_profile
+            )
         else:
-            st.error("Processed data is missing. Please try processing again.")
+            st.error("Processed data is missing or has expired. Please try processing again.")
             reset_processing()
+elif saved_outputs is not None:
+    st.info("📂 Showing saved results. Upload files above to start a new mapping.")
+    if st.session_state.job_id != saved_job:
+        st.session_state.job_id = saved_job
+        st.session_state.validation = validate_outputs(saved_outputs)
+        st.session_state.perf = st.session_state.perf_profile = None
+    results_view(
+        saved_job, saved_outputs, st.session_state.validation, st.session_state.perf, st.session_state.perf_profile
+    )
 else:
     st.info("📋 Instructions: Upload all required files above to begin the mapping process")
     with st.expander("ℹ️ About this app"):
@@ -0,0 +1,177 @@
+# multifile.py
+"""
+Convert many Allied exports that share the same templates and mapping, one worker per file.
+
+Each worker writes its file's outputs to disk and returns only row counts, so memory is bounded
+by the largest single export rather than by the whole batch. Results are either combined into
+one set of outputs (first file wins when a Person_key appears in several files) or kept as one
+ZIP per source file.
+"""
+import glob
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import pandas as pd
+from setup import PIPELINE_EXECUTOR, PIPELINE_WORKERS
+from pipeline import (
+    read_allied, run_pipeline, write_outputs, zip_csv_files, GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV, ZIP_NAME
+)
+
+COMBINED = "combined"
+PER_FILE = "per_file"
+MODES = [COMBINED, PER_FILE]
+OUTPUT_NAMES = [GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV]
+
+def expand_sources(paths):
+    """Expand directories into the .xlsx workbooks they contain (sorted); files are kept as given."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            workbooks = sorted(glob.glob(os.path.join(path, "*.xlsx")))
+            # Skip the lock files Excel leaves next to open workbooks
+            sources.extend(p for p in workbooks if not os.path.basename(p).startswith("~$"))
+        else:
+            sources.append(path)
+    return sources
+
+def source_name(source):
+    """Display name of a source: a path, or a (name, bytes) pair from an upload."""
+    return os.path.basename(source[0] if isinstance(source, tuple) else source)
+
+def output_stems(sources):
+    """One file-name stem per source, made unique when two sources share a name."""
+    stems, used = [], set()
+    for source in sources:
+        stem = os.path.splitext(source_name(source))[0]
+        candidate, suffix = stem, 2
+        while candidate in used:
+            candidate, suffix = f"{stem}_{suffix}", suffix + 1
+        used.add(candidate)
+        stems.append(candidate)
+    return stems
+
+def _read_source(source):
+    if isinstance(source, tuple):
+        return read_allied(io.BytesIO(source[1]))
+    return read_allied(source)
+
+def convert_source(source, templates, general_mapping, out_dir, stem, mode):
+    """
+    Convert one Allied export and write its outputs into out_dir.
+    Per-file mode writes `<stem>_BlueSky.zip`; combined mode writes the three CSVs for merging.
+    Returns: (list of written paths, [general, reqdoc, specialty] row counts).
+    """
+    results = run_pipeline(_read_source(source), *templates, general_mapping)
+    counts = [len(df) for df in results]
+    if mode == PER_FILE:
+        os.makedirs(out_dir, exist_ok=True)
+        zip_path = os.path.join(out_dir, f"{stem}_BlueSky.zip")
+        paths = write_outputs(*results, os.path.join(out_dir, f".{stem}"))
+        zip_csv_files(paths, zip_path)
+        shutil.rmtree(os.path.dirname(paths[0]))
+        return [zip_path], counts
+    return write_outputs(*results, out_dir), counts
+
+def _append_part(part_paths, out_paths, seen_keys):
+    """
+    Append one file's CSVs to the combined outputs, dropping every row of a Person_key
+    already written by an earlier file. Keys are taken from all three outputs: Required Docs and
+    Specialty are keyed by Id even when General Info's Person_key is mapped elsewhere (or not at all).
+    Returns: (rows appended per output, duplicate keys dropped).
+    """
+    frames = [pd.read_csv(path, dtype=str, keep_default_na=False) for path in part_paths]
+    drop = set()
+    if seen_keys is not None:
+        keys = set()
+        for df in frames:
+            if "Person_key" in df.columns:
+                keys.update(df["Person_key"])
+        keys.discard("")
+        drop = keys & seen_keys
+        seen_keys.update(keys)
+    appended = []
+    for df, out_path in zip(frames, out_paths):
+        if drop and "Person_key" in df.columns:
+            df = df[~df["Person_key"].isin(drop)]
+        df.to_csv(out_path, mode="a", header=False, index=False)
+        appended.append(len(df))
+    return appended, len(drop)
+
+def convert_many(sources, general_template, reqdoc_template, specialty_template, general_mapping, out_dir,
+                 mode=COMBINED, as_zip=False, dedupe=True, progress=None,
+                 executor=PIPELINE_EXECUTOR, max_workers=PIPELINE_WORKERS):
+    """
+    Convert several Allied exports with the same templates and mapping in a worker pool.
+    sources: workbook paths or (name, bytes) pairs.
+    mode: COMBINED writes one set of outputs (a ZIP if as_zip); with dedupe, a Person_key already
+          written by an earlier source (in input order) is dropped from later ones. Rows with a
+          blank Person_key (e.g. General Info when it is not mapped) are always kept.
+          PER_FILE writes one `<name>_BlueSky.zip` per source.
+    progress: optional callback(files, index, files_done) after each file finishes, where files are the
+              per-file reports so far and index is the finished one; called from the calling thread.
+    A file that fails to convert is reported and skipped; the others still complete.
+    Returns: {"files": [per-file report dicts, in input order], "outputs": [written paths]}.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    os.makedirs(out_dir, exist_ok=True)
+    templates = (general_template, reqdoc_template, specialty_template)
+    stems = output_stems(sources)
+    files = [
+        {"name": source_name(source), "status": "queued", "error": None, "rows": None,
+         "duplicates_dropped": 0, "output": None}
+        for source in sources
+    ]
+    work_dir = tempfile.mkdtemp(prefix=".allied_batch_", dir=out_dir) if mode == COMBINED else None
+    out_paths = [os.path.join(out_dir, name) for name in OUTPUT_NAMES]
+    if mode == COMBINED:
+        for path, template in zip(out_paths, templates):
+            pd.DataFrame(columns=template.columns).to_csv(path, index=False)
+    seen_keys = set() if dedupe else None
+    parts, next_part = {}, 0
+    pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    try:
+        with pool_class(max_workers=max_workers) as pool:
+            futures = {}
+            for index, (source, stem) in enumerate(zip(sources, stems)):
+                target = os.path.join(work_dir, f"{index:05d}") if mode == COMBINED else out_dir
+                futures[pool.submit(convert_source, source, templates, general_mapping, target, stem, mode)] = index
+            for done, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                report = files[index]
+                try:
+                    paths, counts = future.result()
+                except Exception as e:
+                    report.update(status="failed", error=f"{type(e).__name__}: {e}")
+                    paths = None
+                else:
+                    report.update(status="done", rows=dict(zip(OUTPUT_NAMES, counts)))
+                    if mode == PER_FILE:
+                        report["output"] = paths[0]
+                parts[index] = paths
+                # Combined outputs are appended strictly in input order, so "first file wins" is deterministic
+                while mode == COMBINED and next_part in parts:
+                    part_paths = parts.pop(next_part)
+                    if part_paths is not None:
+                        appended, dropped = _append_part(part_paths, out_paths, seen_keys)
+                        files[next_part]["rows"] = dict(zip(OUTPUT_NAMES, appended))
+                        files[next_part]["duplicates_dropped"] = dropped
+                        shutil.rmtree(os.path.dirname(part_paths[0]))
+                    next_part += 1
+                if progress is not None:
+                    progress(files, index, done)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if mode == COMBINED:
+        if as_zip:
+            outputs = [zip_csv_files(out_paths, os.path.join(out_dir, ZIP_NAME))]
+            for path in out_paths:
+                os.remove(path)
+        else:
+            outputs = out_paths
+    else:
+        outputs = [report["output"] for report in files if report["output"]]
+    return {"files": files, "outputs": outputs}
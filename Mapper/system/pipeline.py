@@ -0,0 +1,438 @@
+# pipeline.py (Allied version)
+import io
+import os
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from setup import REQUIRED_DEFAULTS, PIPELINE_EXECUTOR, PIPELINE_WORKERS, SHARD_ROWS
+from helpers import ensure_str_columns, compact_str_columns, expand_str_columns
+from mapping import apply_mapping
+from processing import (
+    process_required_docs, process_specialties, frame_row_dtype, keys_need_inference, type_person_keys
+)
+from instrument import stage as perf_stage, measured, record_all
+from validation import fill_defaults
+
+# Output file names, in the order they are written to the ZIP
+GENERAL_CSV = "BlueSky_Caregiver_General_Info.csv"
+REQDOC_CSV = "BlueSky_Caregiver_RequiredDocs_Info.csv"
+SPECIALTY_CSV = "BlueSky_Caregiver_Specialty_Info.csv"
+ZIP_NAME = "BlueSky_All_Files.zip"
+
+# Rows per chunk when streaming an Allied workbook
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Output stages in display order, with the Allied columns each one reads (besides mapped fields)
+STAGES = ["General Info", "Required Docs", "Specialty"]
+# Name each stage is recorded under by the instrumentation (see instrument.py)
+STAGE_STEPS = {
+    "General Info": "apply_mapping",
+    "Required Docs": "process_required_docs",
+    "Specialty": "process_specialties"
+}
+STAGE_COLUMNS = {
+    "Required Docs": ["Id", "Allied Certifications"],
+    "Specialty": ["Id"] + [f"Allied/Ancillary Specialty {idx}" for idx in range(1, 4)]
+}
+
+def clean_cols(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip asterisks and surrounding whitespace from template column names."""
+    df.columns = [c.replace("*", "").strip() for c in df.columns]
+    return df
+
+def read_template(source) -> pd.DataFrame:
+    """Read a BlueSky template CSV (path or file-like) and clean its column names."""
+    with perf_stage("read_template"):
+        return clean_cols(pd.read_csv(source))
+
+def read_allied(source) -> pd.DataFrame:
+    """Read a whole Allied Excel export (path or file-like)."""
+    with perf_stage("read_excel") as record:
+        allied = pd.read_excel(source)
+        record["rows_out"] = len(allied)
+    return allied
+
+def _convert_cell(value):
+    """Convert a raw openpyxl cell value the same way pd.read_excel does."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _sheet_rows(source, chunk_size, sheet_name):
+    """Yield (columns, rows, start) for each chunk of converted cell values in a sheet (see iter_excel_chunks)."""
+    from openpyxl import load_workbook
+    if hasattr(source, "seek"):
+        source.seek(0)
+    workbook = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [_convert_cell(v) for v in header]
+        columns = list(TextParser([header], header=0).read().columns)
+        width = len(columns)
+        buffer, blanks, start = [], [], 0
+        for row in rows:
+            row = [_convert_cell(v) for v in row[:width]]
+            row += [""] * (width - len(row))
+            # Blank rows are only kept if more data follows (read_excel drops trailing blanks)
+            if all(v == "" for v in row):
+                blanks.append(row)
+                continue
+            buffer.extend(blanks)
+            blanks = []
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                yield columns, buffer, start
+                start += len(buffer)
+                buffer = []
+        if buffer or start == 0:
+            yield columns, buffer, start
+    finally:
+        workbook.close()
+
+def _whole_file_dtype(dtypes, has_na):
+    """The dtype read_excel infers for a column, given the dtypes inferred for its non-blank chunks."""
+    kinds = {dtype.kind for dtype in dtypes}
+    if len(dtypes) == 1:
+        dtype = next(iter(dtypes))
+    elif kinds <= set("iufb"):
+        # Bools parse as numbers (1, 0) once numbers are in the column
+        dtype = np.dtype(float) if "f" in kinds else np.dtype("int64")
+    else:
+        return np.dtype(object)
+    if has_na and dtype.kind in "iub":
+        # Integers and bools with blanks come out as floats (1.0, 0.0, NaN)
+        return np.dtype(float)
+    return dtype
+
+# Details of a timestamp that decide how pandas prints a whole datetime64 column: dates only
+# unless some value has a time of day, and seconds down to the finest fraction present
+_DATETIME_DETAILS = {
+    "time": lambda values: values != values.dt.normalize(),
+    "ms": lambda values: values.dt.microsecond != 0,
+    "us": lambda values: values.dt.microsecond % 1000 != 0,
+    "ns": lambda values: values.dt.nanosecond != 0,
+}
+
+def _scan_column_types(source, chunk_size, sheet_name):
+    """
+    First pass of iter_excel_chunks: the dtype read_excel would infer for each column of the whole
+    sheet (absent for all-blank columns), and for datetime columns one timestamp showing each detail
+    in _DATETIME_DETAILS found anywhere in the column.
+    """
+    chunk_dtypes, has_na, witnesses = {}, set(), {}
+    for columns, rows, _ in _sheet_rows(source, chunk_size, sheet_name):
+        chunk = TextParser(rows, names=columns, header=None).read()
+        for column in columns:
+            values = chunk[column]
+            if values.hasnans:
+                has_na.add(column)
+            values = values.dropna()
+            if values.empty:
+                continue
+            chunk_dtypes.setdefault(column, set()).add(values.dtype)
+            if values.dtype.kind == "M":
+                found = witnesses.setdefault(column, {})
+                for detail, test in _DATETIME_DETAILS.items():
+                    matches = values[test(values)] if detail not in found else ()
+                    if len(matches):
+                        found[detail] = matches.iloc[0]
+    dtypes = {column: _whole_file_dtype(found, column in has_na) for column, found in chunk_dtypes.items()}
+    return dtypes, {column: list(found.values()) for column, found in witnesses.items()}
+
+def _format_datetimes(values, witnesses):
+    """values as strings, printed with the format pandas would pick for the whole column."""
+    # The format depends on every value in the array, so print the chunk alongside the witnesses
+    combined = pd.concat([pd.Series(witnesses, dtype=values.dtype), values], ignore_index=True)
+    return pd.Series(combined.astype(str).to_numpy()[len(witnesses):], index=values.index, dtype=object)
+
+def _rows_to_frame(rows, columns, start, dtypes, witnesses):
+    """
+    Build a chunk typed like the whole-sheet read_excel result, applying its default NA parsing
+    ('', 'N/A', ...). Datetime columns come back as strings (see _format_datetimes).
+    """
+    # Columns that read_excel leaves as object keep their raw cell values (no per-chunk inference)
+    raw = {column: object for column in columns if dtypes.get(column, np.dtype(object)) == object}
+    chunk = TextParser(rows, names=columns, header=None, dtype=raw).read()
+    for column, dtype in dtypes.items():
+        if dtype == object:
+            continue
+        if dtype.kind == "M":
+            chunk[column] = _format_datetimes(chunk[column].astype(dtype), witnesses.get(column, []))
+        elif chunk[column].dtype != dtype:
+            chunk[column] = chunk[column].astype(dtype)
+    chunk.index = pd.RangeIndex(start, start + len(chunk))
+    return chunk
+
+def iter_excel_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, sheet_name=0):
+    """
+    Stream an Excel sheet (path or seekable file-like) as DataFrame chunks of up to chunk_size rows.
+    Uses openpyxl read-only mode, so memory is bounded by the chunk size rather than the file size.
+    The sheet is read twice: a first pass works out each column's whole-file dtype, so chunks hold
+    the same values pd.read_excel would (duplicate names become 'Name.1', ints with blanks become
+    floats, ...). Datetime columns are returned pre-formatted as strings, since how pandas prints
+    them depends on the whole column (dates only unless some value has a time).
+    """
+    dtypes, witnesses = _scan_column_types(source, chunk_size, sheet_name)
+    for columns, rows, start in _sheet_rows(source, chunk_size, sheet_name):
+        yield _rows_to_frame(rows, columns, start, dtypes, witnesses)
+
+def apply_required_defaults(general):
+    """Fill empty required General Info fields with their REQUIRED_DEFAULTS value."""
+    fill_defaults(general, REQUIRED_DEFAULTS)
+    return general
+
+def run_pipeline(allied, general_template, reqdoc_template, specialty_template, general_mapping, key_dtype=None):
+    """
+    Convert an Allied DataFrame into the three BlueSky outputs.
+    key_dtype: Person_key dtype for an object Id column (default: inferred from the keys, see processing).
+    Returns: (general_df, reqdoc_df, specialty_df), all string-normalized.
+    """
+    general = run_stage("General Info", allied, general_template, general_mapping)
+    reqdoc_df = run_stage("Required Docs", allied, reqdoc_template, key_dtype=key_dtype)
+    specialty_df = run_stage("Specialty", allied, specialty_template, key_dtype=key_dtype)
+    return normalize_outputs(general, reqdoc_df, specialty_df)
+
+def normalize_outputs(general, reqdoc_df, specialty_df):
+    """Final string normalization of the three outputs, with repetitive columns compacted."""
+    with perf_stage("ensure_str_columns", rows_in=len(general) + len(reqdoc_df) + len(specialty_df)) as record:
+        outputs = ensure_str_columns(general), ensure_str_columns(reqdoc_df), ensure_str_columns(specialty_df)
+        record["rows_out"] = sum(len(df) for df in outputs)
+    # Low-cardinality columns stay categorical until they are written out as CSV text
+    with perf_stage("compact_str_columns", rows_in=sum(len(df) for df in outputs)):
+        return tuple(compact_str_columns(df) for df in outputs)
+
+def run_stage(stage, allied, template, general_mapping=None, row_dtype=None, key_dtype=None, normalize=True):
+    """
+    Run a single output stage on (a shard of) the Allied frame.
+    row_dtype, key_dtype, normalize: passed to the Required Docs and Specialty steps (see processing).
+    """
+    if stage not in STAGE_STEPS:
+        raise ValueError(f"Unknown stage: {stage}")
+    with perf_stage(STAGE_STEPS[stage], rows_in=len(allied)) as record:
+        if stage == "General Info":
+            result = apply_required_defaults(apply_mapping(template, general_mapping, allied))
+        elif stage == "Required Docs":
+            result = process_required_docs(allied, template, row_dtype, key_dtype, normalize)
+        else:
+            result = process_specialties(allied, template, row_dtype, key_dtype, normalize)
+        record["rows_out"] = len(result)
+    return result
+
+def _stage_input(stage, allied, general_mapping):
+    """Select only the Allied columns a stage reads, to keep what is shipped to worker processes small."""
+    if stage == "General Info":
+        wanted = (general_mapping or {}).values()
+    else:
+        wanted = STAGE_COLUMNS[stage]
+    columns = list(dict.fromkeys(c for c in wanted if c and c in allied.columns))
+    return allied[columns]
+
+def _concat_shards(frames, ignore_index=False):
+    """Concatenate per-shard results in order, skipping empty shards (which carry object dtypes)."""
+    non_empty = [df for df in frames if len(df)]
+    if not non_empty:
+        return frames[0]
+    if len(non_empty) == 1:
+        return non_empty[0].reset_index(drop=True) if ignore_index else non_empty[0]
+    return pd.concat(non_empty, ignore_index=ignore_index)
+
+def run_pipeline_parallel(allied, general_template, reqdoc_template, specialty_template, general_mapping,
+                          progress=None, executor=PIPELINE_EXECUTOR, max_workers=PIPELINE_WORKERS,
+                          shard_rows=SHARD_ROWS):
+    """
+    Same result as run_pipeline, but the three stages run concurrently in a process (or thread) pool.
+    Inputs larger than shard_rows are split into row ranges so every stage can use several workers.
+    progress: optional callback(stage, shards_done, shards_total), called from the calling thread.
+    Returns: (general_df, reqdoc_df, specialty_df), all string-normalized.
+    """
+    templates = dict(zip(STAGES, (general_template, reqdoc_template, specialty_template)))
+    bounds = list(range(0, len(allied), shard_rows)) or [0]
+    pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    results = {stage: [None] * len(bounds) for stage in STAGES}
+    done = {stage: 0 for stage in STAGES}
+    trace_memory = tracemalloc.is_tracing()
+    # Shards only hold the columns a stage reads, so cells are typed with the whole frame's row dtype;
+    # an object Id column has its Person_key dtype inferred once all shards are back
+    row_dtype = frame_row_dtype(allied)
+    defer_keys = keys_need_inference(allied, row_dtype)
+    key_dtype = object if defer_keys else None
+    with pool_class(max_workers=max_workers) as pool:
+        futures = {}
+        for stage in STAGES:
+            stage_input = _stage_input(stage, allied, general_mapping)
+            for shard, start in enumerate(bounds):
+                # Workers record their own stage timings; they are merged into the caller's recorder
+                future = pool.submit(
+                    measured, trace_memory, run_stage, stage, stage_input.iloc[start:start + shard_rows],
+                    templates[stage], general_mapping, row_dtype, key_dtype, not defer_keys
+                )
+                futures[future] = (stage, shard)
+        for future in as_completed(futures):
+            stage, shard = futures[future]
+            results[stage][shard], records = future.result()
+            record_all(records)
+            done[stage] += 1
+            if progress is not None:
+                progress(stage, done[stage], len(bounds))
+    general = _concat_shards(results["General Info"])
+    reqdoc_df = _concat_shards(results["Required Docs"], ignore_index=True)
+    specialty_df = _concat_shards(results["Specialty"], ignore_index=True)
+    if defer_keys:
+        reqdoc_df, specialty_df = type_person_keys(reqdoc_df), type_person_keys(specialty_df)
+    return normalize_outputs(general, reqdoc_df, specialty_df)
+
+class ExportBundle:
+    """
+    Download artifacts for one processed result, serialized lazily and at most once.
+    Each CSV is encoded on first request; the ZIP is assembled from those encoded bytes.
+    Safe to call from Streamlit's download threads.
+    recorder: optional instrument.PerfRecorder that receives the serialization timings.
+    cache_dir: optional directory (e.g. the result's job directory) where the encoded files are kept
+               instead of in memory, so every session and process serving the result shares them.
+    """
+
+    def __init__(self, general_df, reqdoc_df, specialty_df, recorder=None, cache_dir=None):
+        self.frames = {GENERAL_CSV: general_df, REQDOC_CSV: reqdoc_df, SPECIALTY_CSV: specialty_df}
+        self.recorder = recorder
+        self.cache_dir = cache_dir
+        self._encoded = {}
+        self._zip = None
+        self._lock = threading.Lock()
+
+    def csv_bytes(self, name):
+        """Return the UTF-8 CSV for one output file, serializing it on first use."""
+        with self._lock:
+            if self.cache_dir is not None:
+                return self._cached(name, lambda: self._encode(name))
+            if name not in self._encoded:
+                self._encoded[name] = self._encode(name)
+            return self._encoded[name]
+
+    def zip_bytes(self):
+        """Return a ZIP of all three CSVs, building it on first use."""
+        if self.cache_dir is not None:
+            return self._cached(ZIP_NAME, self._build_zip)
+        if self._zip is None:
+            data = self._build_zip()
+            with self._lock:
+                if self._zip is None:
+                    self._zip = data
+        return self._zip
+
+    def _encode(self, name):
+        with self._stage(f"to_csv:{name}", len(self.frames[name])):
+            return expand_str_columns(self.frames[name]).to_csv(index=False).encode()
+
+    def _build_zip(self):
+        encoded = {name: self.csv_bytes(name) for name in self.frames}
+        zip_buffer = io.BytesIO()
+        with self._stage("zip", None), zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for name, data in encoded.items():
+                zip_file.writestr(name, data)
+        return zip_buffer.getvalue()
+
+    def _cached(self, file_name, build):
+        path = os.path.join(self.cache_dir, file_name)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        data = build()
+        # Write under a temporary name first, so a concurrent reader never sees a partial file
+        fd, partial = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        return data
+
+    def _stage(self, name, rows_in):
+        # Downloads run outside the script thread, so record into our own recorder rather than the active one
+        if self.recorder is None:
+            return nullcontext()
+        return self.recorder.stage(name, rows_in)
+
+    def csv_getter(self, name):
+        """Return a zero-argument callable for st.download_button's lazy `data`."""
+        return lambda: self.csv_bytes(name)
+
+def create_zip_with_csvs(general_df, reqdoc_df, specialty_df):
+    """Return the bytes of a ZIP archive holding all three output CSVs."""
+    return ExportBundle(general_df, reqdoc_df, specialty_df).zip_bytes()
+
+def zip_csv_files(paths, zip_path):
+    """Write the CSV files at paths into a ZIP archive, streaming them from disk."""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for path in paths:
+            zip_file.write(path, os.path.basename(path))
+    return zip_path
+
+def run_pipeline_chunked(allied_chunks, general_template, reqdoc_template, specialty_template,
+                         general_mapping, out_dir, as_zip=False):
+    """
+    Run each Allied chunk through the pipeline and append the results to the output CSVs,
+    so peak memory depends on the chunk size rather than the size of the export.
+    Chunks are expected to hold the whole file's column dtypes, as iter_excel_chunks yields them.
+    Person_key keeps the Id column's dtype instead of being inferred from one chunk's keys. The files
+    only differ from a whole-file run if all text Ids belong to workers without output rows and a
+    worker with output rows has a blank Id (whole-file keys then print as floats).
+    Returns: (list of written file paths, {file name: data rows written}).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = [
+        (GENERAL_CSV, general_template),
+        (REQDOC_CSV, reqdoc_template),
+        (SPECIALTY_CSV, specialty_template)
+    ]
+    paths = [os.path.join(out_dir, name) for name, _ in outputs]
+    for path, (_, template) in zip(paths, outputs):
+        pd.DataFrame(columns=template.columns).to_csv(path, index=False)
+    counts = {name: 0 for name, _ in outputs}
+    for chunk in allied_chunks:
+        key_dtype = chunk["Id"].dtype if "Id" in chunk.columns else None
+        results = run_pipeline(chunk, general_template, reqdoc_template, specialty_template, general_mapping,
+                               key_dtype)
+        with perf_stage("write_csv", rows_in=sum(len(df) for df in results)):
+            for path, (name, _), df in zip(paths, outputs, results):
+                expand_str_columns(df).to_csv(path, mode="a", header=False, index=False)
+                counts[name] += len(df)
+    if as_zip:
+        with perf_stage("zip"):
+            zip_path = zip_csv_files(paths, os.path.join(out_dir, ZIP_NAME))
+        for path in paths:
+            os.remove(path)
+        paths = [zip_path]
+    return paths, counts
+
+def write_outputs(general_df, reqdoc_df, specialty_df, out_dir, as_zip=False):
+    """
+    Write the three output CSVs (or a single ZIP holding them) into out_dir.
+    Returns: List of written file paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rows = len(general_df) + len(reqdoc_df) + len(specialty_df)
+    if as_zip:
+        path = os.path.join(out_dir, ZIP_NAME)
+        with perf_stage("zip", rows_in=rows), open(path, "wb") as f:
+            f.write(create_zip_with_csvs(general_df, reqdoc_df, specialty_df))
+        return [path]
+    paths = []
+    with perf_stage("write_csv", rows_in=rows):
+        for name, df in ((GENERAL_CSV, general_df), (REQDOC_CSV, reqdoc_df), (SPECIALTY_CSV, specialty_df)):
+            path = os.path.join(out_dir, name)
+            expand_str_columns(df).to_csv(path, index=False)
+            paths.append(path)
+    return paths
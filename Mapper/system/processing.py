@@ -1,7 +1,11 @@
 # processing.py (Allied version)
+import numpy as np
 import pandas as pd
 from helpers import ensure_str_columns
 
+# Placeholder values that count as "no data" inside multi-value fields
+EMPTY_VALUES = ["nan", "null", "none", "n/a", "na"]
+
 def process_general_info(allied_df, general_template):
     """Map Allied fields to BlueSky General Info template columns."""
     # Only keep columns found in template
@@ -10,86 +14,139 @@ def process_general_info(allied_df, general_template):
     output = output.fillna("")
     return ensure_str_columns(output)
 
-def process_required_docs(allied_df, reqdoc_template):
-    """Explode Allied Certifications into individual required docs rows (only for workers with certifications)."""
-    reqdoc_rows = []
-    for _, row in allied_df.iterrows():
-        pid = row.get("Id")
-        certs_raw = row.get("Allied Certifications", None)
-        
-        # Enhanced validation to ensure we only process workers with actual certifications
-        if (
-            certs_raw is not None
-            and pd.notna(certs_raw)  # Check pandas null/NaN
-            and str(certs_raw).strip()  # Check not empty string
-            and str(certs_raw).strip().lower() not in ["nan", "null", "none", ""]  # Check common empty values
-        ):
-            certs = str(certs_raw).split(',')
-            # Track if this worker has any valid certifications
-            has_valid_certs = False
-            
-            for cert in certs:
-                cert = cert.strip()
-                # Only add if certification is not empty after cleaning
-                if cert and cert.lower() not in ["nan", "null", "none", "n/a", "na"]:
-                    has_valid_certs = True
-                    reqdoc_rows.append({
-                        "Person_key": pid,
-                        "CertificationCredentialName": cert,
-                        "IssueComment": "",
-                        "Expiration Date": "",
-                        "Note": "",
-                        "Verified": ""
-                    })
-            
-            # If no valid certifications were found for this worker, they are automatically skipped
-            # (no rows added to reqdoc_rows)
-    
+def frame_row_dtype(allied_df):
+    """The dtype DataFrame.iterrows gives every row of allied_df: the common dtype of its columns."""
+    return allied_df.iloc[:0].to_numpy().dtype
+
+def _row_values(allied_df, col, row_dtype=None):
+    """
+    allied_df[col] with cells typed as DataFrame.iterrows gives them: every row holds the frame's
+    common dtype, so in an all-numeric frame an int column reads as floats (1001 -> 1001.0).
+    row_dtype: the common dtype to apply, when allied_df is a column subset or shard of a larger frame.
+    """
+    if row_dtype is None:
+        row_dtype = frame_row_dtype(allied_df)
+    values = allied_df[col]
+    return values if row_dtype == object else values.astype(row_dtype)
+
+def _person_keys(allied_df, positions, row_dtype=None, key_dtype=None):
+    """
+    Return Person_key values for the given row positions, typed as when output rows were built from
+    row dicts: the dtype is re-inferred from the keys that produced rows, so an object Id column of
+    ints gives floats if a blank Id is among them. None for every row if there is no Id column.
+    key_dtype: use this dtype instead of inferring one (object keeps the raw Id values).
+    One difference remains: iterrows turned a blank Id into NaT when every other cell in its row was
+    a date, which kept the other keys as ints; here it stays NaN and they print as floats.
+    """
+    if "Id" not in allied_df.columns:
+        return np.full(len(positions), None, dtype=object)
+    keys = _row_values(allied_df, "Id", row_dtype)
+    if isinstance(keys.dtype, np.dtype) and keys.dtype != object:
+        # Numpy columns already have the dtype the keys would be inferred as
+        return keys.to_numpy()[positions]
+    keys = pd.Series(keys.astype(object).to_numpy()[positions], dtype=object)
+    return (keys.infer_objects() if key_dtype is None else keys.astype(key_dtype)).to_numpy()
+
+def keys_need_inference(allied_df, row_dtype=None):
+    """True if the Person_key dtype depends on which Ids produce rows (an object or extension Id column)."""
+    if "Id" not in allied_df.columns:
+        return False
+    dtype = _row_values(allied_df, "Id", row_dtype).dtype
+    return not isinstance(dtype, np.dtype) or dtype == object
+
+def type_person_keys(df):
+    """
+    Finish rows built with key_dtype=object and normalize=False, e.g. one stage's shards concatenated:
+    infer the Person_key dtype from all the keys at once, then string-normalize the frame.
+    """
+    if "Person_key" in df.columns:
+        keys = pd.Series(df["Person_key"].to_numpy(), index=df.index, dtype=object)
+        df = df.assign(Person_key=keys.infer_objects())
+    return ensure_str_columns(df)
+
+def _split_tokens(values):
+    """
+    Split comma-separated values into stripped, non-empty tokens.
+    The result is indexed by the source row position, in original order.
+    """
+    # Cells are printed one by one (as str() does), not with a column-wide datetime format
+    tokens = values.astype(object).astype(str).str.split(",").explode().str.strip()
+    return tokens[tokens != ""]
+
+def process_required_docs(allied_df, reqdoc_template, row_dtype=None, key_dtype=None, normalize=True):
+    """
+    Explode Allied Certifications into individual required docs rows (only for workers with certifications).
+    row_dtype / key_dtype: see _row_values and _person_keys.
+    normalize: False returns the rows before string normalization (see type_person_keys).
+    """
+    if "Allied Certifications" not in allied_df.columns:
+        return pd.DataFrame(columns=reqdoc_template.columns)
+
+    # Work positionally so a non-unique index on the Allied frame can't misalign Ids
+    certs = _row_values(allied_df, "Allied Certifications", row_dtype).reset_index(drop=True)
+    certs = _split_tokens(certs[certs.notna()])
+
+    # Drop common placeholder values; workers left with nothing are skipped
+    certs = certs[~certs.str.lower().isin(EMPTY_VALUES)]
+
     # Return empty DataFrame with proper columns if no workers have certifications
-    if not reqdoc_rows:
+    if certs.empty:
         return pd.DataFrame(columns=reqdoc_template.columns)
-    return ensure_str_columns(pd.DataFrame(reqdoc_rows, columns=reqdoc_template.columns))
-
-def process_specialties(allied_df, specialty_template):
-    """Explode Allied/Ancillary Specialty 1/2/3 into individual specialty rows with deduplication."""
-    specialty_rows = []
-    
-    for _, row in allied_df.iterrows():
-        pid = row.get("Id")
-        
-        # Step 1: Collect all specialties from all 3 columns
-        all_specialties = []
-        for idx in range(1, 4):
-            col = f"Allied/Ancillary Specialty {idx}"
-            val = row.get(col, "")
-            if pd.notna(val) and val:
-                # Split comma-separated values and clean them
-                for part in str(val).split(','):
-                    part = part.strip()
-                    if part:
-                        all_specialties.append(part)
-        
-        # Step 2: Remove duplicates while preserving order (first occurrence)
-        unique_specialties = []
-        seen = set()
-        for specialty in all_specialties:
-            # Case-insensitive comparison for deduplication
-            specialty_lower = specialty.lower()
-            if specialty_lower not in seen:
-                unique_specialties.append(specialty)
-                seen.add(specialty_lower)
-        
-        # Step 3: Create rows for each unique specialty
-        for specialty in unique_specialties:
-            specialty_rows.append({
-                "Person_key": pid,
-                "Specialty": specialty,
-                "Complete": "",
-                "Complete Date": "",
-                "Expiration Date": "",
-                "UploadedFile": ""
-            })
-    
-    if not specialty_rows:
+    reqdoc_df = pd.DataFrame({
+        "Person_key": _person_keys(allied_df, certs.index.to_numpy(), row_dtype, key_dtype),
+        "CertificationCredentialName": certs.to_numpy(),
+        "IssueComment": "",
+        "Expiration Date": "",
+        "Note": "",
+        "Verified": ""
+    })
+    reqdoc_df = reqdoc_df.reindex(columns=reqdoc_template.columns)
+    return ensure_str_columns(reqdoc_df) if normalize else reqdoc_df
+
+def process_specialties(allied_df, specialty_template, row_dtype=None, key_dtype=None, normalize=True):
+    """
+    Explode Allied/Ancillary Specialty 1/2/3 into individual specialty rows with deduplication.
+    row_dtype, key_dtype, normalize: as for process_required_docs.
+    """
+    # Step 1: Stack all specialties from all 3 columns, keyed by row position
+    parts = []
+    for idx in range(1, 4):
+        col = f"Allied/Ancillary Specialty {idx}"
+        if col not in allied_df.columns:
+            continue
+        vals = _row_values(allied_df, col, row_dtype).reset_index(drop=True)
+        vals = vals[vals.notna()]
+        if vals.dtype == object or pd.api.types.is_numeric_dtype(vals.dtype):
+            # Falsy cells (0, False) are skipped just like empty strings
+            vals = vals[vals != 0]
+        parts.append(_split_tokens(vals))
+    if not parts:
+        return pd.DataFrame(columns=specialty_template.columns)
+    specialties = pd.concat(parts)
+
+    # Regroup by worker; the stable sort keeps column order and in-cell order per worker
+    order = np.argsort(specialties.index.to_numpy(), kind="stable")
+    specialties = specialties.iloc[order]
+
+    # Step 2: Remove duplicates per worker row while preserving order (first occurrence)
+    # Case-insensitive comparison for deduplication
+    rows = pd.DataFrame({
+        "pos": specialties.index.to_numpy(),
+        "key": specialties.str.lower().to_numpy(),
+        "Specialty": specialties.to_numpy()
+    }).drop_duplicates(["pos", "key"])
+
+    if rows.empty:
         return pd.DataFrame(columns=specialty_template.columns)
-    return ensure_str_columns(pd.DataFrame(specialty_rows, columns=specialty_template.columns))
+
+    # Step 3: Create rows for each unique specialty
+    specialty_df = pd.DataFrame({
+        "Person_key": _person_keys(allied_df, rows["pos"].to_numpy(), row_dtype, key_dtype),
+        "Specialty": rows["Specialty"].to_numpy(),
+        "Complete": "",
+        "Complete Date": "",
+        "Expiration Date": "",
+        "UploadedFile": ""
+    })
+    specialty_df = specialty_df.reindex(columns=specialty_template.columns)
+    return ensure_str_columns(specialty_df) if normalize else specialty_df
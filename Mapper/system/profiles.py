@@ -0,0 +1,158 @@
+# profiles.py
+import hashlib
+import json
+import os
+import re
+from setup import PROFILE_DIR
+from automap import normalize_colname
+
+# Labels used for the three mapping screens (and as keys in saved profiles)
+MAPPING_LABELS = ["General Info", "Required Docs", "Specialty"]
+PROFILE_VERSION = 1
+PROFILE_FORMATS = ["json", "yaml"]
+
+def _yaml():
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("YAML profiles need PyYAML (pip install pyyaml); use JSON instead") from None
+    return yaml
+
+def template_fingerprint(columns):
+    """Return a short digest identifying a template by its (normalized, unordered) column set."""
+    names = sorted({normalize_colname(c) for c in columns})
+    return hashlib.blake2b("\n".join(names).encode(), digest_size=8).hexdigest()
+
+def build_profile(name, mappings, templates):
+    """
+    Build a profile from {label: {template_col: source_col}} mappings.
+    templates: {label: template DataFrame (or its columns)}, used to fingerprint each mapping.
+    Unmapped fields (empty selections) are left out.
+    """
+    profile = {"name": name, "version": PROFILE_VERSION, "mappings": {}}
+    for label in MAPPING_LABELS:
+        columns = getattr(templates[label], "columns", templates[label])
+        profile["mappings"][label] = {
+            "fingerprint": template_fingerprint(columns),
+            "fields": {t_col: s_col for t_col, s_col in (mappings.get(label) or {}).items() if s_col}
+        }
+    return profile
+
+def dump_profile(profile, fmt="json"):
+    """Serialize a profile as JSON or YAML text."""
+    if fmt == "yaml":
+        return _yaml().safe_dump(profile, sort_keys=False, allow_unicode=True)
+    return json.dumps(profile, indent=2)
+
+def parse_profile(data):
+    """
+    Normalize loaded profile data.
+    Also accepts the older {label: {template_col: source_col}} mapping files, and a flat
+    {template_col: source_col} object, which is treated as the General Info mapping.
+    Returns: {"name", "version", "mappings": {label: {"fingerprint", "fields"}}}.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Mapping profile must contain an object")
+    if isinstance(data.get("mappings"), dict):
+        sections = data["mappings"]
+    elif any(label in data for label in MAPPING_LABELS):
+        sections = {label: {"fields": data.get(label)} for label in MAPPING_LABELS}
+    else:
+        sections = {"General Info": {"fields": data}}
+    mappings = {}
+    for label in MAPPING_LABELS:
+        section = sections.get(label) or {}
+        fields = section.get("fields") or {}
+        if not isinstance(fields, dict):
+            raise ValueError(f"Mapping for {label} must be an object of template field -> source column")
+        mappings[label] = {
+            "fingerprint": section.get("fingerprint"),
+            "fields": {str(t_col): str(s_col) for t_col, s_col in fields.items() if s_col}
+        }
+    return {"name": data.get("name") or "", "version": data.get("version", PROFILE_VERSION), "mappings": mappings}
+
+def load_profile(source, fmt=None):
+    """
+    Load a profile from a path or file-like object (JSON or YAML).
+    The format is taken from fmt, else the file extension, else JSON.
+    """
+    name = source if isinstance(source, str) else getattr(source, "name", "")
+    if fmt is None:
+        fmt = "yaml" if str(name).lower().endswith((".yaml", ".yml")) else "json"
+    if isinstance(source, str):
+        with open(source, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = source.read()
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+    if fmt == "yaml":
+        yaml = _yaml()
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid YAML profile: {e}") from e
+    else:
+        data = json.loads(text)
+    return parse_profile(data)
+
+def validate_fields(fields, template_columns, source_columns):
+    """
+    Check a saved {template_col: source_col} mapping against the current template and source in one pass.
+    Returns: (applicable mapping, template fields no longer in the template, source columns not in the source).
+    """
+    template_set = set(template_columns)
+    source_set = set(source_columns)
+    applied, unknown_fields, missing_sources = {}, [], []
+    for t_col, s_col in fields.items():
+        if t_col not in template_set:
+            unknown_fields.append(t_col)
+        elif s_col not in source_set:
+            missing_sources.append(s_col)
+        else:
+            applied[t_col] = s_col
+    return applied, unknown_fields, missing_sources
+
+def profile_match_score(profile, fingerprints):
+    """Number of mapping screens whose template fingerprint matches the profile."""
+    return sum(
+        1 for label, fingerprint in fingerprints.items()
+        if profile["mappings"].get(label, {}).get("fingerprint") == fingerprint
+    )
+
+class ProfileStore:
+    """Mapping profiles saved as JSON files in a local directory."""
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+
+    def path_for(self, name):
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_") or "profile"
+        return os.path.join(self.directory, f"{slug}.json")
+
+    def save(self, profile):
+        """Write a profile, replacing any saved profile with the same name. Returns the file path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(profile["name"])
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(dump_profile(profile))
+        return path
+
+    def load_all(self):
+        """Return all readable saved profiles, sorted by name."""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for file_name in sorted(os.listdir(self.directory)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                profiles.append(load_profile(os.path.join(self.directory, file_name)))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def suggest(self, fingerprints):
+        """Saved profiles whose template fingerprints match, best match first."""
+        scored = [(profile_match_score(p, fingerprints), p) for p in self.load_all()]
+        return [p for score, p in sorted(scored, key=lambda item: -item[0]) if score > 0]
@@ -0,0 +1,69 @@
+# search.py
+import numpy as np
+import pandas as pd
+from helpers import ensure_str_columns
+
+# Ways a search term can be matched against a column's values
+SEARCH_MODES = ["Contains", "Starts with", "Exact"]
+
+class SearchIndex:
+    """
+    Case-insensitive search over the columns of one processed DataFrame.
+
+    Each column is indexed on first use: its lowercased values are factorized into
+    integer codes plus sorted unique values. A search only scans the (usually few)
+    unique values and then maps the matches back to rows through the codes, so
+    repeated searches and paging never rescan the full text column.
+    """
+
+    def __init__(self, df):
+        self.source = df
+        self.df = ensure_str_columns(df)
+        self._columns = {}
+        self._last_search = None
+
+    def _column(self, col):
+        """Return (codes, sorted lowercase uniques) for a column, building them on first use."""
+        if col not in self._columns:
+            values = self.df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Lowercase each category once, then translate the row codes
+                category_codes, uniques = pd.factorize(values.cat.categories.str.lower(), sort=True)
+                codes = category_codes[values.cat.codes.to_numpy()]
+            else:
+                codes, uniques = pd.factorize(values.str.lower(), sort=True)
+            self._columns[col] = (codes, np.asarray(uniques, dtype=object))
+        return self._columns[col]
+
+    def search(self, col, term, mode="Contains", regex=False):
+        """
+        Return the row positions whose value in col matches term (case-insensitive).
+        mode: one of SEARCH_MODES; regex=True treats term as a regular expression (Contains only).
+        """
+        key = (col, term, mode, regex)
+        if self._last_search is not None and self._last_search[0] == key:
+            return self._last_search[1]
+        codes, uniques = self._column(col)
+        needle = term.lower()
+        if regex or mode == "Contains":
+            matched = pd.Series(uniques, dtype=object).str.contains(
+                term if regex else needle, case=not regex, regex=regex, na=False
+            ).to_numpy(dtype=bool)
+        else:
+            # Sorted uniques turn prefix/exact lookups into a binary search
+            lo = np.searchsorted(uniques, needle, side="left")
+            if mode == "Starts with":
+                hi = np.searchsorted(uniques, needle + "\U0010ffff", side="left")
+            else:
+                hi = np.searchsorted(uniques, needle, side="right")
+            matched = np.zeros(len(uniques), dtype=bool)
+            matched[lo:hi] = True
+        positions = np.flatnonzero(matched[codes]) if len(uniques) else np.array([], dtype=np.intp)
+        self._last_search = (key, positions)
+        return positions
+
+    def rows(self, start, stop, positions=None):
+        """Materialize only rows [start, stop) of the full frame or of a search result."""
+        if positions is None:
+            return self.df.iloc[start:stop]
+        return self.df.iloc[positions[start:stop]]
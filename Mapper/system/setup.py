@@ -1,4 +1,5 @@
 # setup.py
+import os
 import pandas as pd
 
 VALID_STATE_CODES = {
@@ -34,3 +35,43 @@ FALLBACK_MAP = {
     "MName": "Middle Name",
     "EMail": "Email"
 }
+
+# Parsed-upload / processed-result caches (shared by all sessions in the Streamlit process)
+CACHE_MAX_ENTRIES = 16
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Parallel processing of the three output stages
+PIPELINE_EXECUTOR = "process"  # "process" or "thread"
+PIPELINE_WORKERS = None        # None = one per CPU core
+SHARD_ROWS = 100_000           # Allied rows per shard; larger inputs are split into row ranges
+
+# Output text columns with at most this many distinct values per row are held as Categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Auto-mapping: minimum similarity for a fuzzy match to be listed as a suggestion.
+# Fuzzy matches are never applied automatically; only exact names and fallback maps are.
+AUTOMAP_MIN_SCORE = 0.6
+
+# Processed results kept on disk by job ID (see jobstore.py); sessions hold only the ID.
+# Jobs unused for JOB_STORE_TTL_SECONDS are evicted, then least recently used ones beyond JOB_STORE_MAX_BYTES.
+JOB_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs")
+JOB_STORE_MAX_BYTES = 5 * 1024 ** 3
+JOB_STORE_TTL_SECONDS = 24 * 60 * 60
+JOB_STORE_OPEN_JOBS = 8        # Jobs kept memory-mapped per process
+
+# Saved mapping profiles (one JSON file per profile)
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# Data-quality checks run on the outputs after processing (see validation.py).
+# "check" is "regex" (full match), "isin" (case-insensitive set membership) or "date" (parseable, within min/max).
+# Blank cells pass (required fields are filled from REQUIRED_DEFAULTS); columns not in the template are skipped.
+VALIDATION_RULES = [
+    {"name": "state", "output": "General Info", "columns": ["State"], "check": "isin", "values": VALID_STATE_CODES},
+    {"name": "zip", "output": "General Info", "columns": ["ZIPCode"], "check": "regex", "pattern": r"\d{5}(-\d{4})?"},
+    {"name": "phone", "output": "General Info", "columns": ["Phone1", "cellPhone1"], "check": "regex",
+     "pattern": r"(\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"},
+    {"name": "email", "output": "General Info", "columns": ["EMail"], "check": "regex",
+     "pattern": r"[^@\s]+@[^@\s]+\.[A-Za-z]{2,}"},
+    {"name": "birthdate", "output": "General Info", "columns": ["BirthDate"], "check": "date",
+     "min": "1900-01-01", "max": "today"}
+]
@@ -0,0 +1,6 @@
+# conftest.py
+"""Make the app modules (flat files in Mapper/system) importable from the tests."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+# test_automap.py
+from automap import build_column_index, is_auto_match, EXACT_SCORE
+
+def test_similar_name_is_only_suggested():
+    # 'Status' scores ~0.6 against 'State'; applying it would override the "Active" default
+    index = build_column_index(["Id", "State", "Email"])
+    ranked = index.suggest(["Status"])["Status"]
+    assert ranked and ranked[0][0] == "State"
+    assert not is_auto_match(ranked[0][1])
+    assert "Status" not in index.best_matches(["Status"])
+
+def test_exact_and_prior_matches_apply():
+    index = build_column_index(["Id", "State", "First Name", "E-Mail Address"])
+    best = index.best_matches(["State", "Fname"])
+    assert best["State"] == ("State", EXACT_SCORE)
+    assert best["Fname"][0] == "First Name"
@@ -0,0 +1,26 @@
+# test_cache.py
+import pandas as pd
+import jobstore
+from cache import save_result_cached, saved_jobs
+from jobstore import JobStore
+
+def test_unchanged_inputs_reuse_the_saved_job(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobstore, "_default_store", store)
+    saved_jobs.clear()
+    saves = []
+    save = store.save
+    monkeypatch.setattr(store, "save", lambda *args: saves.append(args) or save(*args))
+    outputs = {"General Info": pd.DataFrame({"Person_key": ["1", "2"]})}
+    hashes = ("allied", "general", "reqdoc", "specialty")
+
+    job_id, report = save_result_cached(outputs, hashes, {"Person_key": "Id"}, {"allied_file": "a.xlsx"})
+    assert save_result_cached(outputs, hashes, {"Person_key": "Id"}) == (job_id, report)
+    assert len(saves) == 1
+
+    # A different mapping is a different result; an evicted job is saved again
+    assert save_result_cached(outputs, hashes, {"Person_key": "Email"})[0] != job_id
+    store.delete(job_id)
+    assert save_result_cached(outputs, hashes, {"Person_key": "Id"})[0] not in (None, job_id)
+    assert len(saves) == 3
+    saved_jobs.clear()
@@ -0,0 +1,79 @@
+# test_delta.py
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import delta
+from delta import run_delta
+from pipeline import run_pipeline
+
+GENERAL = pd.DataFrame(columns=["Person_key", "Fname", "Lname", "Status"])
+REQDOC = pd.DataFrame(columns=["Person_key", "CertificationCredentialName", "IssueComment"])
+SPECIALTY = pd.DataFrame(columns=["Person_key", "Specialty", "Complete"])
+TEMPLATES = (GENERAL, REQDOC, SPECIALTY)
+MAPPING = {"Person_key": "Id", "Fname": "First Name", "Lname": "Last Name"}
+
+def make_allied(n, seed, first_id=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Id": np.arange(first_id, first_id + n),
+        "First Name": rng.choice(["Ann", None, "Bob", "Cy"], n),
+        "Last Name": [f"L{i}" for i in range(n)],
+        "Allied Certifications": rng.choice(["BLS, ACLS", None, "RN", "n/a"], n),
+        **{f"Allied/Ancillary Specialty {i}": rng.choice(["ICU, ER", "icu", None, "Lab"], n) for i in (1, 2, 3)}
+    })
+
+def assert_matches_full_run(result, allied):
+    for got, expected in zip(result["full"], run_pipeline(allied, *TEMPLATES, MAPPING)):
+        assert got.to_csv(index=False) == expected.to_csv(index=False)
+
+def test_delta_matches_full_run(tmp_path):
+    state = str(tmp_path / "state")
+    first = make_allied(500, 1)
+    assert not run_delta(first, *TEMPLATES, MAPPING, state)["stats"]["incremental"]
+
+    # Change some workers, drop two, insert new ones at both ends and reorder a block
+    second = first.copy()
+    second.loc[[5, 50, 400], "Allied Certifications"] = "PALS, CPR"
+    second.loc[[7], "First Name"] = "Zed"
+    second = second.drop(index=[10, 11])
+    second = pd.concat([make_allied(3, 2, 10_000), second.iloc[100:200], second.iloc[:100], second.iloc[200:],
+                        make_allied(3, 3, 20_000)], ignore_index=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        result = run_delta(second, *TEMPLATES, MAPPING, state)
+    assert result["stats"] == {"added": 6, "changed": 4, "removed": 2, "unchanged": 494, "incremental": True}
+    assert sorted(result["removed"]) == ["10", "11"]
+    assert_matches_full_run(result, second)
+
+    # Unchanged export: nothing is re-derived, and the state is reused as is
+    result = run_delta(second, *TEMPLATES, MAPPING, state)
+    assert result["stats"]["unchanged"] == len(second)
+    assert all(len(df) == 0 for df in result["delta"])
+    assert_matches_full_run(result, second)
+
+def test_changed_mapping_falls_back_to_full_run(tmp_path):
+    state = str(tmp_path / "state")
+    allied = make_allied(50, 1)
+    run_delta(allied, *TEMPLATES, MAPPING, state)
+    result = run_delta(allied, *TEMPLATES, dict(MAPPING, Status="Last Name"), state)
+    assert not result["stats"]["incremental"]
+
+def test_interrupted_save_falls_back_to_full_run(tmp_path, monkeypatch):
+    state = str(tmp_path / "state")
+    first = make_allied(50, 1)
+    run_delta(first, *TEMPLATES, MAPPING, state)
+
+    # Crash after the new hashes are written but before the outputs are
+    def crash(df, path):
+        raise OSError("disk full")
+    second = first.copy()
+    second.loc[[3], "Allied Certifications"] = "PALS"
+    monkeypatch.setattr(delta, "write_frame", crash)
+    with pytest.raises(OSError):
+        run_delta(second, *TEMPLATES, MAPPING, state)
+    monkeypatch.undo()
+
+    result = run_delta(second, *TEMPLATES, MAPPING, state)
+    assert not result["stats"]["incremental"]
+    assert_matches_full_run(result, second)
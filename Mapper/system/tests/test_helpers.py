@@ -0,0 +1,27 @@
+# test_helpers.py
+import numpy as np
+import pandas as pd
+from helpers import compact_str_values, ensure_str_columns, is_str_normalized, normalize_str_values
+from mapping import apply_mapping
+
+def test_null_like_text_in_string_columns_is_blanked():
+    df = pd.DataFrame({"a": pd.array(["None", "null", "x"], dtype="string")})
+    assert ensure_str_columns(df)["a"].tolist() == ["", "", "x"]
+    assert ensure_str_columns(df.copy(), inplace=True)["a"].tolist() == ["", "", "x"]
+
+def test_null_like_categories_are_blanked():
+    values = pd.Categorical(["NaT", "x", "x"], categories=pd.Index(["NaT", "x"], dtype="string"))
+    assert ensure_str_columns(pd.DataFrame({"a": values}))["a"].tolist() == ["", "x", "x"]
+
+def test_apply_mapping_blanks_null_like_text():
+    source = pd.DataFrame({"Status": pd.array(["NULL", "Active"], dtype="string")})
+    template = pd.DataFrame(columns=["Status"])
+    assert apply_mapping(template, {"Status": "Status"}, source)["Status"].tolist() == ["", "Active"]
+
+def test_normalized_arrays_are_shared():
+    df = pd.DataFrame({"a": ["x", np.nan, "None"]})
+    normalized = ensure_str_columns(df)
+    assert is_str_normalized(normalized["a"])
+    assert ensure_str_columns(normalized)["a"].array is normalized["a"].array
+    compacted = pd.Series(compact_str_values(normalize_str_values(pd.Series(["x", "y"] * 10))))
+    assert is_str_normalized(compacted)
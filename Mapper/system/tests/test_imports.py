@@ -0,0 +1,11 @@
+# test_imports.py
+from benchmark import check_imports, IMPORT_BUDGET_MS
+
+def test_headless_modules_skip_ui_and_fit_import_budget():
+    # Same check as `python -m benchmark --imports`
+    failures = [(module, ms, ui) for module, ms, ui, failed in check_imports() if failed]
+    assert not failures, f"over {IMPORT_BUDGET_MS} ms or importing UI packages: {failures}"
+
+def test_normalize_colname_still_importable_from_mapping():
+    from mapping import normalize_colname
+    assert normalize_colname(" First\xa0Name* ") == "first name"
@@ -0,0 +1,67 @@
+# test_jobstore.py
+import os
+import time
+import pandas as pd
+from helpers import compact_str_columns, ensure_str_columns, is_str_normalized
+from jobstore import JobStore
+
+def test_created_job_directories_are_evicted_after_ttl(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"), ttl_seconds=60)
+    job_id = store.create({"kind": "batch"})
+    path = store.path_for(job_id)
+    with open(os.path.join(path, "out.csv"), "w") as f:
+        f.write("a\n1\n")
+    assert store.load(job_id) == {}
+    assert store.job_bytes(job_id) == 4
+    assert store.evict(now=time.time() + 120) == [job_id]
+    assert not os.path.exists(path)
+    assert store.load(job_id) is None
+
+def _assert_round_trip(store, outputs):
+    job_id = store.save(outputs, {"kind": "test"})
+    loaded = store.load(job_id)
+    assert list(loaded) == list(outputs)
+    for name, df in outputs.items():
+        pd.testing.assert_frame_equal(loaded[name], df.reset_index(drop=True))
+    return loaded
+
+def test_compacted_and_arrow_string_columns_round_trip(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"))
+    general = pd.DataFrame({"Person_key": [str(i) for i in range(50)], "Status": ["Active", "Inactive"] * 25})
+    reqdoc = pd.DataFrame({
+        "Person_key": pd.array(["1", "2", "", "3"], dtype="string[pyarrow]"),
+        "CertificationCredentialName": ["BLS", "RN", "BLS", "ACLS"],
+    }, index=[5, 6, 7, 8])
+    outputs = {name: compact_str_columns(ensure_str_columns(df)) for name, df in
+               [("General Info", general), ("Required Docs", reqdoc)]}
+    assert isinstance(outputs["General Info"]["Status"].dtype, pd.CategoricalDtype)
+    loaded = _assert_round_trip(store, outputs)
+    status = loaded["General Info"]["Status"]
+    assert isinstance(status.dtype, pd.CategoricalDtype)
+    assert status.cat.categories.dtype == "string"
+    assert is_str_normalized(status)
+    assert loaded["Required Docs"]["Person_key"].dtype == "string"
+
+    # An empty output keeps its categorical column
+    empty = pd.DataFrame({"Person_key": pd.Categorical([], categories=pd.Index([], dtype="string[pyarrow]"))})
+    _assert_round_trip(store, {"Specialty": empty})
+
+def test_size_budget_evicts_least_recently_used_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"))
+    outputs = {"General Info": pd.DataFrame({"Person_key": [f"{i:06d}" for i in range(2_000)]})}
+    first = store.save(outputs)
+    second = store.save(outputs)
+    job_bytes = store.job_bytes(first)
+    # Room for two jobs: opening the first makes the second the least recently used
+    store.max_bytes = 2 * job_bytes
+    time.sleep(0.01)
+    assert store.load(first) is not None
+    third = store.save(outputs)
+    assert store.load(second) is None and not os.path.exists(store.path_for(second))
+    assert store.load(first) is not None and store.load(third) is not None
+
+    # The job just saved is kept even if it alone is over the budget
+    store.max_bytes = job_bytes // 2
+    fourth = store.save(outputs)
+    assert store.load(fourth) is not None
+    assert all(store.load(job_id) is None for job_id in (first, third))
@@ -0,0 +1,26 @@
+# test_multifile.py
+import pandas as pd
+from benchmark import generate_templates
+from multifile import GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV, convert_many
+
+def _allied(ids, emails):
+    return pd.DataFrame({
+        "Id": ids,
+        "EMail": emails,
+        "Allied Certifications": ["BLS"] * len(ids),
+        "Allied/Ancillary Specialty 1": ["ICU"] * len(ids),
+    })
+
+def test_combined_dedupe_uses_the_keys_of_every_output(tmp_path):
+    sources = []
+    for name, df in [("a.xlsx", _allied([1, 2], ["a@x", "b@x"])), ("b.xlsx", _allied([2, 3], ["b@x", "c@x"]))]:
+        path = tmp_path / name
+        df.to_excel(path, index=False)
+        sources.append(str(path))
+    out_dir = tmp_path / "out"
+    # General Info's Person_key is not mapped, so only Required Docs and Specialty carry worker Ids
+    result = convert_many(sources, *generate_templates(), {"EMail": "EMail"}, str(out_dir), executor="thread")
+    assert [report["duplicates_dropped"] for report in result["files"]] == [0, 1]
+    for name in (REQDOC_CSV, SPECIALTY_CSV):
+        assert pd.read_csv(out_dir / name)["Person_key"].tolist() == [1, 2, 3]
+    assert len(pd.read_csv(out_dir / GENERAL_CSV)) == 4
@@ -0,0 +1,126 @@
+# test_pipeline.py
+import datetime as dt
+import filecmp
+import io
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from benchmark import GENERAL_MAPPING, generate_allied, generate_templates, write_fixture
+from helpers import ensure_str_columns
+from instrument import PerfRecorder
+from pipeline import (
+    GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV, ZIP_NAME, ExportBundle, iter_excel_chunks, normalize_outputs, read_allied,
+    run_pipeline, run_pipeline_chunked, run_pipeline_parallel, run_stage, write_outputs
+)
+
+def _write_workbook(path, header, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+def _chunked(path, chunk_size):
+    return pd.concat(list(iter_excel_chunks(path, chunk_size)))
+
+def test_chunks_match_read_excel(tmp_path):
+    # Every column's whole-file dtype only shows up once all chunks have been seen
+    path = tmp_path / "allied.xlsx"
+    header = ["Id", "Phone", "Birthday", "Hired", "Active", "Code", "Id"]
+    rows = [
+        [1001, 5551230000, dt.datetime(1981, 2, 15), dt.datetime(2020, 1, 1), True, "00123", 1],
+        [1002, 5551230001, dt.datetime(1990, 7, 1), dt.datetime(2021, 3, 4), False, "00124", 2],
+        [1003, 5551230002, dt.datetime(1975, 12, 31), dt.datetime(2022, 5, 6), True, "00125", 3],
+        [1004, None, None, dt.datetime(2023, 8, 9, 14, 30), None, "N/A", None],
+        [1005, 5551230004, dt.datetime(1988, 3, 3), None, False, "abc", 5],
+    ]
+    _write_workbook(path, header, rows)
+    expected = ensure_str_columns(pd.read_excel(path))
+    for chunk_size in (1, 2, 3, len(rows)):
+        pd.testing.assert_frame_equal(ensure_str_columns(_chunked(path, chunk_size)), expected)
+    assert expected["Birthday"].tolist() == ["1981-02-15", "1990-07-01", "1975-12-31", "", "1988-03-03"]
+    assert expected["Phone"][0] == "5551230000.0"
+
+def test_chunks_keep_trailing_blank_rows_out(tmp_path):
+    path = tmp_path / "allied.xlsx"
+    _write_workbook(path, ["Id", "Name"], [[1, "a"], [None, None], [2, "b"], [None, None], [None, None]])
+    expected = ensure_str_columns(pd.read_excel(path))
+    pd.testing.assert_frame_equal(ensure_str_columns(_chunked(path, 2)), expected)
+
+def _assert_chunked_matches_whole_file(tmp_path, allied_path, chunk_size):
+    templates = generate_templates()
+    whole_dir, chunked_dir = tmp_path / "whole", tmp_path / "chunked"
+    outputs = run_pipeline(read_allied(allied_path), *templates, GENERAL_MAPPING)
+    names = [os.path.basename(path) for path in write_outputs(*outputs, str(whole_dir))]
+    run_pipeline_chunked(iter_excel_chunks(allied_path, chunk_size), *templates, GENERAL_MAPPING, str(chunked_dir))
+    match, mismatch, errors = filecmp.cmpfiles(whole_dir, chunked_dir, names, shallow=False)
+    assert (mismatch, errors) == ([], [])
+
+def test_chunked_pipeline_matches_whole_file(tmp_path):
+    # Date columns and numeric columns with blank cells, spread over 700-row chunks
+    paths = write_fixture(str(tmp_path / "fixture"), generate_allied(3_000, seed=1))
+    _assert_chunked_matches_whole_file(tmp_path, paths["allied"], 700)
+
+def test_chunked_person_keys_match_whole_file(tmp_path):
+    # The second chunk only holds a numeric Id and a blank one, which alone would print as floats
+    path = tmp_path / "allied.xlsx"
+    _write_workbook(path, ["Id", "Allied Certifications", "Allied/Ancillary Specialty 1"],
+                    [["P1", "BLS", "ICU"], [1002, "RN", "ER"], [1003, "ACLS", "OR"], [None, "PALS", "ICU"]])
+    _assert_chunked_matches_whole_file(tmp_path, str(path), 2)
+    assert (tmp_path / "chunked" / REQDOC_CSV).read_text().splitlines()[3][:5] == "1003,"
+
+def _assert_same_outputs(expected, actual):
+    for expected_df, actual_df in zip(expected, actual):
+        assert actual_df.to_csv(index=False) == expected_df.to_csv(index=False)
+
+def test_parallel_pipeline_matches_serial():
+    templates = generate_templates()
+    cases = [
+        # Shards only get the columns a stage reads, but cells keep the whole frame's row dtype
+        pd.DataFrame({"Id": [1, 2], "First Name": ["a", "b"], "Allied Certifications": [5.0, 7.0]}),
+        # The Person_key dtype comes from every key, not just those of one shard
+        pd.DataFrame({
+            "Id": pd.Series([1001, "P2", 1003, 1004, np.nan, 1006], dtype=object),
+            "Allied Certifications": ["BLS", "RN", "BLS", "ACLS", "PALS", "RN"],
+            "Allied/Ancillary Specialty 1": ["ICU", "ER", "ICU", "OR", "ER", "ICU"],
+        }),
+        generate_allied(500, null_rate=0.2, seed=3),
+    ]
+    for allied in cases:
+        expected = run_pipeline(allied, *templates, GENERAL_MAPPING)
+        for shard_rows in (1, 3, 200):
+            actual = run_pipeline_parallel(allied, *templates, GENERAL_MAPPING, executor="thread",
+                                           max_workers=2, shard_rows=shard_rows)
+            _assert_same_outputs(expected, actual)
+
+def test_export_bundle_writes_compacted_outputs_as_plain_csv(tmp_path):
+    allied = generate_allied(2_000, null_rate=0.2, seed=4)
+    templates = generate_templates()
+    stages = [run_stage("General Info", allied, templates[0], GENERAL_MAPPING),
+              run_stage("Required Docs", allied, templates[1]), run_stage("Specialty", allied, templates[2])]
+    compacted = normalize_outputs(*stages)
+    assert any(isinstance(dtype, pd.CategoricalDtype) for df in compacted for dtype in df.dtypes)
+    names = [GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV]
+    expected = {name: ensure_str_columns(df).to_csv(index=False).encode() for name, df in zip(names, stages)}
+
+    for cache_dir in (None, tmp_path):
+        recorder = PerfRecorder()
+        bundle = ExportBundle(*compacted, recorder=recorder, cache_dir=None if cache_dir is None else str(cache_dir))
+        assert {name: bundle.csv_bytes(name) for name in names} == expected
+        with zipfile.ZipFile(io.BytesIO(bundle.zip_bytes())) as archive:
+            assert {name: archive.read(name) for name in archive.namelist()} == expected
+        # Each file is serialized once, however often it is requested
+        assert bundle.zip_bytes() == bundle.zip_bytes()
+        assert bundle.csv_getter(GENERAL_CSV)() == expected[GENERAL_CSV]
+        stages_run = sorted(record["stage"] for record in recorder.records)
+        assert stages_run == sorted(["zip"] + [f"to_csv:{name}" for name in names])
+
+    # The cached files are shared: another bundle on the same directory serves them without encoding
+    assert sorted(os.listdir(tmp_path)) == sorted(names + [ZIP_NAME])
+    empty = [df.iloc[:0] for df in compacted]
+    shared = ExportBundle(*empty, cache_dir=str(tmp_path))
+    assert shared.csv_bytes(REQDOC_CSV) == expected[REQDOC_CSV]
+    assert shared.zip_bytes() == (tmp_path / ZIP_NAME).read_bytes()
@@ -0,0 +1,161 @@
+# test_processing.py
+import random
+import numpy as np
+import pandas as pd
+from helpers import ensure_str_columns
+from processing import process_required_docs, process_specialties
+
+# Copies of the original row-by-row implementations; the vectorized versions must match them exactly
+
+def legacy_process_required_docs(allied_df, reqdoc_template):
+    reqdoc_rows = []
+    for _, row in allied_df.iterrows():
+        pid = row.get("Id")
+        certs_raw = row.get("Allied Certifications", None)
+        if (
+            certs_raw is not None
+            and pd.notna(certs_raw)
+            and str(certs_raw).strip()
+            and str(certs_raw).strip().lower() not in ["nan", "null", "none", ""]
+        ):
+            for cert in str(certs_raw).split(','):
+                cert = cert.strip()
+                if cert and cert.lower() not in ["nan", "null", "none", "n/a", "na"]:
+                    reqdoc_rows.append({
+                        "Person_key": pid,
+                        "CertificationCredentialName": cert,
+                        "IssueComment": "",
+                        "Expiration Date": "",
+                        "Note": "",
+                        "Verified": ""
+                    })
+    if not reqdoc_rows:
+        return pd.DataFrame(columns=reqdoc_template.columns)
+    return ensure_str_columns(pd.DataFrame(reqdoc_rows, columns=reqdoc_template.columns))
+
+def legacy_process_specialties(allied_df, specialty_template):
+    specialty_rows = []
+    for _, row in allied_df.iterrows():
+        pid = row.get("Id")
+        all_specialties = []
+        for idx in range(1, 4):
+            col = f"Allied/Ancillary Specialty {idx}"
+            val = row.get(col, "")
+            if pd.notna(val) and val:
+                for part in str(val).split(','):
+                    part = part.strip()
+                    if part:
+                        all_specialties.append(part)
+        unique_specialties = []
+        seen = set()
+        for specialty in all_specialties:
+            specialty_lower = specialty.lower()
+            if specialty_lower not in seen:
+                unique_specialties.append(specialty)
+                seen.add(specialty_lower)
+        for specialty in unique_specialties:
+            specialty_rows.append({
+                "Person_key": pid,
+                "Specialty": specialty,
+                "Complete": "",
+                "Complete Date": "",
+                "Expiration Date": "",
+                "UploadedFile": ""
+            })
+    if not specialty_rows:
+        return pd.DataFrame(columns=specialty_template.columns)
+    return ensure_str_columns(pd.DataFrame(specialty_rows, columns=specialty_template.columns))
+
+REQDOC_TEMPLATE = pd.DataFrame(columns=[
+    "Person_key", "CertificationCredentialName", "IssueComment", "Expiration Date", "Note", "Verified", "Extra"
+])
+SPECIALTY_TEMPLATE = pd.DataFrame(columns=[
+    "Person_key", "Specialty", "Complete", "Complete Date", "Expiration Date", "UploadedFile"
+])
+CERT_TOKENS = ["BLS", " ACLS", "PALS ", "nan", "N/A", "na", "", " ", "None", "RN", "rn", "NULL"]
+SPECIALTY_TOKENS = ["ICU", "icu", " Nursing", "Radiology ", "ER", "", " ", "nan", "Lab"]
+
+def random_ids(rng, n):
+    """An Id column of one of the shapes seen in Allied exports (ints, ints with blanks, text, ...)."""
+    kind = rng.choice(["int", "object_int_blank", "float_blank", "text", "mixed"])
+    if kind == "int":
+        return pd.Series(np.arange(1000, 1000 + n), dtype="int64")
+    if kind == "object_int_blank":
+        return pd.Series([1000 + i if rng.random() > 0.2 else rng.choice([np.nan, None, ""]) for i in range(n)],
+                         dtype=object)
+    if kind == "float_blank":
+        return pd.Series([1000.0 + i if rng.random() > 0.2 else np.nan for i in range(n)])
+    if kind == "text":
+        return pd.Series([f"P{i}" for i in range(n)], dtype=object)
+    return pd.Series([rng.choice([1000 + i, f"P{i}", np.nan, 1000.5]) for i in range(n)], dtype=object)
+
+def random_certs(rng, n):
+    if rng.random() < 0.15:
+        # An all-numeric frame: iterrows hands every cell over as float
+        return pd.Series([rng.choice([1, 2, 0]) for _ in range(n)], dtype="int64")
+    cells = []
+    for _ in range(n):
+        r = rng.random()
+        cells.append(np.nan if r < 0.1 else None if r < 0.15 else 3.5 if r < 0.2
+                     else ",".join(rng.choice(CERT_TOKENS) for _ in range(rng.randint(1, 4))))
+    return pd.Series(cells, dtype=object)
+
+def assert_same_output(expected, actual):
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.to_csv(index=False) == expected.to_csv(index=False)
+
+def test_required_docs_match_legacy_loop():
+    for seed in range(300):
+        rng = random.Random(seed)
+        n = rng.randint(0, 25)
+        allied = pd.DataFrame({"Id": random_ids(rng, n), "Allied Certifications": random_certs(rng, n)})
+        if rng.random() < 0.3:
+            allied.index = [rng.randint(0, 3) for _ in range(n)]
+        if rng.random() < 0.1:
+            allied = allied.drop(columns="Id")
+        assert_same_output(legacy_process_required_docs(allied, REQDOC_TEMPLATE),
+                           process_required_docs(allied, REQDOC_TEMPLATE))
+
+def test_blank_id_among_int_ids_gives_float_keys():
+    allied = pd.DataFrame({"Id": pd.Series([1001, np.nan], dtype=object), "Allied Certifications": ["BLS", "RN"]})
+    assert process_required_docs(allied, REQDOC_TEMPLATE)["Person_key"].tolist() == ["1001.0", ""]
+
+def random_specialties(rng, n, dates=True):
+    """A specialty column: comma-separated text, or numbers, bools or dates as odd exports have them."""
+    kind = rng.choice(["text", "text", "text", "int", "float", "bool"] + ["date"] * dates)
+    if kind == "int":
+        return pd.Series([rng.choice([0, 1, 2]) for _ in range(n)], dtype="int64")
+    if kind == "float":
+        return pd.Series([rng.choice([0.0, 1.5, 2.0, np.nan]) for _ in range(n)])
+    if kind == "bool":
+        return pd.Series([rng.choice([True, False]) for _ in range(n)], dtype=bool)
+    if kind == "date":
+        return pd.Series([pd.Timestamp(2020, 1, rng.randint(1, 3)) if rng.random() > 0.2 else pd.NaT
+                          for _ in range(n)])
+    cells = []
+    for _ in range(n):
+        r = rng.random()
+        cells.append(np.nan if r < 0.1 else None if r < 0.15 else 0 if r < 0.2
+                     else ",".join(rng.choice(SPECIALTY_TOKENS) for _ in range(rng.randint(1, 3))))
+    return pd.Series(cells, dtype=object)
+
+def test_specialties_match_legacy_loop():
+    for seed in range(300):
+        rng = random.Random(seed)
+        n = rng.randint(0, 25)
+        allied = pd.DataFrame({"Id": random_ids(rng, n)})
+        # Blank Ids in all-date rows are a known difference (see processing._person_keys)
+        dates = not allied["Id"].isna().any()
+        for idx in rng.sample([1, 2, 3], rng.randint(0, 3)):
+            allied[f"Allied/Ancillary Specialty {idx}"] = random_specialties(rng, n, dates)
+        if rng.random() < 0.3:
+            allied.index = [rng.randint(0, 3) for _ in range(n)]
+        assert_same_output(legacy_process_specialties(allied, SPECIALTY_TEMPLATE),
+                           process_specialties(allied, SPECIALTY_TEMPLATE))
+
+def test_all_numeric_row_gives_float_keys():
+    # iterrows upcast the whole row to float, so Id 1 came out as '1.0'
+    allied = pd.DataFrame({"Id": [1, 2], "Allied/Ancillary Specialty 1": [2.5, 3.0]})
+    result = process_specialties(allied, SPECIALTY_TEMPLATE)
+    assert result["Person_key"].tolist() == ["1.0", "2.0"]
+    assert result["Specialty"].tolist() == ["2.5", "3.0"]
@@ -0,0 +1,72 @@
+# test_profiles.py
+import io
+import json
+import pytest
+from profiles import (
+    MAPPING_LABELS, PROFILE_VERSION, ProfileStore, build_profile, dump_profile, load_profile, parse_profile,
+    template_fingerprint, validate_fields
+)
+
+TEMPLATES = {
+    "General Info": ["Person_key", "Fname", "Lname"],
+    "Required Docs": ["Person_key", "CertificationCredentialName"],
+    "Specialty": ["Person_key", "Specialty"],
+}
+MAPPINGS = {"General Info": {"Person_key": "Id", "Fname": "First Name", "Lname": ""}}
+
+def test_parse_profile_current_format_round_trips():
+    profile = build_profile("Acme", MAPPINGS, TEMPLATES)
+    # Empty selections are left out, and every screen is present
+    assert profile["mappings"]["General Info"]["fields"] == {"Person_key": "Id", "Fname": "First Name"}
+    assert profile["mappings"]["Specialty"] == {"fingerprint": template_fingerprint(TEMPLATES["Specialty"]),
+                                                "fields": {}}
+    assert parse_profile(json.loads(dump_profile(profile))) == profile
+    assert load_profile(io.StringIO(dump_profile(profile))) == profile
+    assert load_profile(io.BytesIO(dump_profile(profile, "yaml").encode()), fmt="yaml") == profile
+
+def test_parse_profile_older_and_flat_formats():
+    # Older mapping files: {label: {template_col: source_col}}, without name, version or fingerprints
+    older = parse_profile({"General Info": {"Fname": "First Name", "Lname": None}, "Specialty": {"Specialty": 1}})
+    assert older["name"] == "" and older["version"] == PROFILE_VERSION
+    assert older["mappings"]["General Info"] == {"fingerprint": None, "fields": {"Fname": "First Name"}}
+    assert older["mappings"]["Specialty"]["fields"] == {"Specialty": "1"}
+    assert older["mappings"]["Required Docs"]["fields"] == {}
+    # A flat object is the General Info mapping
+    flat = parse_profile({"Fname": "First Name", "Person_key": "Id"})
+    assert flat["mappings"]["General Info"]["fields"] == {"Fname": "First Name", "Person_key": "Id"}
+    assert list(flat["mappings"]) == MAPPING_LABELS
+
+@pytest.mark.parametrize("data", [["Fname"], "Fname", {"mappings": {"General Info": {"fields": ["Fname"]}}}])
+def test_parse_profile_rejects_malformed_data(data):
+    with pytest.raises(ValueError):
+        parse_profile(data)
+
+def test_validate_fields():
+    fields = {"Fname": "First Name", "Gone": "Id", "Lname": "Surname", "Person_key": "Id"}
+    applied, unknown_fields, missing_sources = validate_fields(
+        fields, TEMPLATES["General Info"], ["Id", "First Name", "Last Name"]
+    )
+    assert applied == {"Fname": "First Name", "Person_key": "Id"}
+    assert unknown_fields == ["Gone"]
+    assert missing_sources == ["Surname"]
+
+def test_template_fingerprint_ignores_order_case_and_decoration():
+    fingerprint = template_fingerprint(["Person_key", "Fname", "Lname"])
+    assert template_fingerprint(["lname", " FNAME*", "Person_key", "Fname"]) == fingerprint
+    assert template_fingerprint(["Person_key", "Fname"]) != fingerprint
+    assert len(fingerprint) == 16
+
+def test_store_suggests_matching_profiles_best_first(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles"))
+    assert store.suggest({}) == []
+    other = dict(TEMPLATES, Specialty=["Person_key", "Skill"])
+    store.save(build_profile("Partial match", MAPPINGS, other))
+    store.save(build_profile("Full match", MAPPINGS, TEMPLATES))
+    store.save(build_profile("No match", MAPPINGS, {label: ["X"] for label in MAPPING_LABELS}))
+    (tmp_path / "profiles" / "broken.json").write_text("{not json")
+    fingerprints = {label: template_fingerprint(columns) for label, columns in TEMPLATES.items()}
+    assert [p["name"] for p in store.suggest(fingerprints)] == ["Full match", "Partial match"]
+    # Saving under the same name replaces the file
+    store.save(build_profile("Full match", {}, TEMPLATES))
+    assert [p["name"] for p in store.load_all()] == ["Full match", "No match", "Partial match"]
+    assert store.load_all()[0]["mappings"]["General Info"]["fields"] == {}
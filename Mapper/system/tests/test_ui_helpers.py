@@ -0,0 +1,20 @@
+# test_ui_helpers.py
+import logging
+from streamlit.testing.v1 import AppTest
+
+def preview_app():
+    import pandas as pd
+    from ui_helpers import display_data_with_controls
+    df = pd.DataFrame({"Person_key": [str(i) for i in range(200)], "Fname": ["Ann", "Bob"] * 100})
+    display_data_with_controls(df, "general", "general")
+
+def test_page_is_clamped_without_session_state_warning(caplog):
+    at = AppTest.from_function(preview_app).run()
+    at.selectbox(key="general_page_size").select(20).run()
+    at.number_input(key="general_page").set_value(8).run()
+    with caplog.at_level(logging.WARNING):
+        at.selectbox(key="general_search_col").select("Person_key").run()
+        at.text_input(key="general_search_term").input("19").run()
+    assert not at.exception
+    assert at.number_input(key="general_page").value == 1
+    assert not [r for r in caplog.records if "Session State API" in r.getMessage()]
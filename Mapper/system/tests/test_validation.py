@@ -0,0 +1,100 @@
+# test_validation.py
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from helpers import compact_str_columns, ensure_str_columns
+from validation import build_rules, check_column, fill_defaults, validate_outputs
+
+DEFAULTS = {"Region": "Unknown Region", "Fname": "Not Provided", "Status": "Active"}
+RULES = [
+    {"name": "zip", "output": "General Info", "columns": ["ZIPCode"], "check": "regex", "pattern": r"\d{5}(-\d{4})?"},
+    {"name": "state", "output": "General Info", "columns": ["State"], "check": "isin", "values": ["CA", "NY"]},
+    {"name": "birthdate", "output": "General Info", "columns": ["BirthDate"], "check": "date",
+     "min": "1900-01-01", "max": "today"},
+    {"name": "phone", "output": "General Info", "columns": ["Phone1", "cellPhone1"], "check": "regex",
+     "pattern": r"\d{10}"},
+    {"name": "specialty", "output": "Specialty", "columns": ["Specialty"], "check": "isin", "values": ["ICU"]},
+]
+
+def legacy_fill_defaults(df, defaults):
+    # The loop fill_defaults replaced
+    for field, default in defaults.items():
+        if field in df.columns:
+            df[field] = df[field].fillna(default).replace("", default)
+    return df
+
+def test_fill_defaults_matches_fillna_replace_loop():
+    cells = ["Ann", "", np.nan, None, " ", "Bob", "nan"]
+    for seed in range(50):
+        rng = random.Random(seed)
+        n = rng.randint(0, 12)
+        df = pd.DataFrame({column: [rng.choice(cells) for _ in range(n)] for column in ("Region", "Fname", "Lname")},
+                          dtype=object)
+        if rng.random() < 0.5:
+            df["Fname"] = df["Fname"].astype("string")
+        expected = ensure_str_columns(legacy_fill_defaults(df.copy(), DEFAULTS))
+        actual = df.copy()
+        filled = fill_defaults(actual, DEFAULTS)
+        assert ensure_str_columns(actual).to_csv(index=False) == expected.to_csv(index=False)
+        blanks = df.isna() | (df == "")
+        assert filled == {column: int(blanks[column].sum()) for column in ("Region", "Fname")}
+
+def test_fill_defaults_on_categorical_columns():
+    df = compact_str_columns(ensure_str_columns(pd.DataFrame({"Status": ["", "Inactive", ""] * 10})))
+    assert isinstance(df["Status"].dtype, pd.CategoricalDtype)
+    assert fill_defaults(df, DEFAULTS) == {"Status": 20}
+    assert df["Status"].tolist() == ["Active", "Inactive", "Active"] * 10
+
+@pytest.mark.parametrize("rule, values, expected", [
+    (RULES[0], ["12345", "12345-6789", "1234", "abcde", "", np.nan, "12345-"], [0, 0, 1, 1, 0, 0, 1]),
+    (RULES[1], ["CA", " ny ", "ca", "TX", "", np.nan, "California"], [0, 0, 0, 1, 0, 0, 1]),
+    (RULES[2], ["1981-02-15", "02/15/1981", "1899-12-31", "2999-01-01", "not a date", "", np.nan],
+     [0, 0, 1, 1, 1, 0, 0]),
+])
+def test_checks_on_plain_and_categorical_columns(rule, values, expected):
+    # Blank and missing cells pass every check
+    plain = pd.Series(values * 3, dtype=object)
+    categorical = plain.astype("category")
+    for series in (plain, plain.astype("string"), categorical):
+        assert check_column(series, rule).astype(int).tolist() == expected * 3
+
+def test_bitmap_bits_and_error_labels():
+    outputs = {
+        "General Info": pd.DataFrame({
+            "ZIPCode": ["12345", "bad", "bad", ""],
+            "State": ["CA", "CA", "TX", ""],
+            "Phone1": ["5551230000", "5551230000", "555", ""],
+            "cellPhone1": ["555", "5551230000", "5551230000", ""],
+        }),
+        "Specialty": pd.DataFrame({"Specialty": ["ICU", "Lab"]}),
+        "Required Docs": pd.DataFrame({"Person_key": ["1"]}),
+    }
+    report = validate_outputs(outputs, RULES)
+    assert report.bitmaps["General Info"].dtype == np.uint8
+    # Bit i is set for rule i; a rule on two columns sets one bit for either
+    assert report.bitmaps["General Info"].tolist() == [0b01000, 0b00001, 0b01011, 0]
+    assert report.bitmaps["Specialty"].tolist() == [0, 0b10000]
+    assert report.bitmaps["Required Docs"].tolist() == [0]
+    assert report.counts() == {"General Info": 3, "Specialty": 1, "Required Docs": 0}
+    assert report.rows_with_errors("General Info").tolist() == [0, 1, 2]
+    assert report.error_labels("General Info").tolist() == ["phone", "zip", "zip, state, phone", ""]
+    assert report.error_labels("General Info", [2, 0]).tolist() == ["zip, state, phone", "phone"]
+    # BirthDate is not in the output, so the date rule is skipped
+    summary = report.summary()
+    assert "birthdate" not in set(summary["Rule"])
+    assert summary.loc[summary["Rule"] == "phone", ["Column", "Failed"]].values.tolist() == [
+        ["Phone1", 1], ["cellPhone1", 1]
+    ]
+
+def test_bitmap_widens_with_the_rule_count():
+    rules = [dict(RULES[0], name=f"zip{i}") for i in range(9)]
+    report = validate_outputs({"General Info": pd.DataFrame({"ZIPCode": ["bad", "12345"]})}, rules)
+    assert report.bitmaps["General Info"].dtype == np.uint16
+    assert report.bitmaps["General Info"].tolist() == [0b111111111, 0]
+    with pytest.raises(ValueError):
+        validate_outputs({"General Info": pd.DataFrame({"ZIPCode": ["1"]})}, rules * 8)
+
+def test_unknown_check_is_rejected():
+    with pytest.raises(ValueError):
+        build_rules([{"name": "x", "columns": ["A"], "check": "length"}], specialties=[])
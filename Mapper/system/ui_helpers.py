@@ -1,76 +1,172 @@
+import os
 import streamlit as st
 import pandas as pd
 
 from helpers import ensure_str_columns
+from automap import build_column_index, is_auto_match, EXACT_SCORE
+from search import SearchIndex, SEARCH_MODES
+from profiles import (
+    MAPPING_LABELS, ProfileStore, build_profile, dump_profile, load_profile, template_fingerprint, validate_fields
+)
+from cache import upload_bytes
+from multifile import convert_many, COMBINED, PER_FILE, OUTPUT_NAMES
+from jobstore import default_store
+from pipeline import ExportBundle, zip_csv_files, GENERAL_CSV, REQDOC_CSV, SPECIALTY_CSV, ZIP_NAME
+
+# Page sizes offered for the processed data preview
+PAGE_SIZES = [20, 50, 100, 500]
+
+# Output choices when several Allied files are uploaded
+BATCH_MODES = {
+    "Combined (one set of BlueSky files)": COMBINED,
+    "One ZIP per Allied file": PER_FILE
+}
+
+def reset_processing():
+    """
+    Reset all Streamlit session state variables to allow a new mapping and processing run.
+    """
+    st.session_state.processed = False
+    # The stored job itself is left to the job store's eviction
+    st.session_state.job_id = None
+    if "job" in st.query_params:
+        del st.query_params["job"]
+    st.session_state.perf = None
+    st.session_state.perf_profile = None
+    st.session_state.validation = None
+    # Batch outputs are a job in the job store; drop them now rather than waiting for eviction
+    batch_result = st.session_state.get("batch_result")
+    if batch_result is not None:
+        default_store().delete(batch_result["job_id"])
+    st.session_state.batch_result = None
+    # Drop cached preview search indexes so they don't pin the old frames
+    for key in [k for k in st.session_state.keys() if str(k).endswith("_search_index")]:
+        del st.session_state[key]
+    # No license_df needed for Allied
+
+def get_mapping(template_df, source_df, label):
+    """
+    Streamlit widget for mapping BlueSky template fields to Allied dataset columns.
+    Supports auto-mapping (exact names, fallback maps, then fuzzy name similarity)
+    and manual mapping via select boxes.
+    Returns: Dictionary {template_col: source_col}.
+    """
+    st.markdown(f"#### {label} Field Mapping")
+    mapping_key = f"{label}_mapping"
+    suggestions_key = f"{label}_suggestions"
+    column_index = build_column_index(source_df.columns)
+    if mapping_key not in st.session_state or st.session_state[mapping_key] is None:
+        st.session_state[mapping_key] = {}
+    if st.button(f"Auto-map fields for {label}", key=f"automap_{label}"):
+        suggestions = column_index.suggest(template_df.columns)
+        st.session_state[suggestions_key] = suggestions
+        for t_col, ranked in suggestions.items():
+            if not ranked:
+                continue
+            source_col, score = ranked[0]
+            # Exact name matches always apply and fallback-map matches fill fields that are still
+            # unmapped; fuzzy matches stay suggestions (shown on each field) for the user to pick
+            if score >= EXACT_SCORE or (is_auto_match(score) and not st.session_state[mapping_key].get(t_col)):
+                st.session_state[mapping_key][t_col] = source_col
+                st.session_state[f"{label}_{t_col}"] = source_col
+    suggestions = st.session_state.get(suggestions_key) or {}
+    with st.expander(f"Manually map fields for {label}", expanded=True):
+        for target_field in template_df.columns:
+            widget_key = f"{label}_{target_field}"
+            current_value = st.session_state[mapping_key].get(target_field, "")
+            index_value = column_index.position.get(current_value, 0) if widget_key not in st.session_state else 0
+            ranked = suggestions.get(target_field)
+            selected = st.selectbox(
+                f"Map BlueSky '{target_field}' to Allied field:",
+                column_index.options,
+                index=index_value,
+                key=widget_key,
+                help="Suggestions: " + ", ".join(f"{col} ({score:.0%})" for col, score in ranked) if ranked else None
+            )
+            st.session_state[mapping_key][target_field] = selected
+    return st.session_state[mapping_key]
+
+def get_search_index(df, key_prefix):
+    """
+    Return the SearchIndex for a preview tab, building it only when the frame changes.
+    """
+    index_key = f"{key_prefix}_search_index"
+    index = st.session_state.get(index_key)
+    if index is None or index.source is not df:
+        index = SearchIndex(df)
+        st.session_state[index_key] = index
+    return index
 
 def display_data_with_controls(df, name, key_prefix):
     """
     Show a preview of generated records in a paged table, with filter/search UI in Streamlit.
+    Only the visible page is materialized; searches use a per-frame cached index.
     """
-    df = ensure_str_columns(df)
     total_rows = len(df)
     st.write(f"**{total_rows} {name} records generated**")
     if total_rows == 0:
         st.info(f"No {name} records found to display.")
         return
+    index = get_search_index(df, key_prefix)
+
+    positions = None
     col1, col2, col3 = st.columns([1, 1, 1])
-    max_rows = max(5, min(500, total_rows))
-    default_rows = min(20, max_rows)
     with col1:
-        show_rows = st.number_input(
-            "Rows to display:",
-            min_value=5,
-            max_value=max_rows,
-            value=default_rows,
-            step=5,
-            key=f"{key_prefix}_rows"
-        )
-    with col2:
-        max_start = max(0, total_rows - 1)
-        start_row = st.number_input(
-            "Start from row:",
-            min_value=0,
-            max_value=max_start,
-            value=0,
-            key=f"{key_prefix}_start"
-        )
-    with col3:
-        if st.button(f"Show all records", key=f"{key_prefix}_all"):
-            show_rows = total_rows
-            start_row = 0
-    end_row = min(start_row + show_rows, total_rows)
-    if start_row > 0 or end_row < total_rows:
-        st.write(f"Showing rows {start_row} to {end_row - 1} of {total_rows}")
-    st.dataframe(df.iloc[start_row:end_row], use_container_width=True)
-
-    if not df.empty and len(df.columns) > 0:
         search_col = st.selectbox(
             "Search/Filter by column:",
-            ["None"] + list(df.columns),
+            ["None"] + list(index.df.columns),
             key=f"{key_prefix}_search_col"
         )
-        if search_col != "None":
+    if search_col != "None":
+        with col2:
             search_term = st.text_input(
                 f"Enter search term for {search_col}:",
                 key=f"{key_prefix}_search_term"
             )
-            if search_term:
-                try:
-                    filtered_df = df[df[search_col].astype(str).str.contains(search_term, case=False, na=False)]
-                    filtered_df = ensure_str_columns(filtered_df)
-                    st.write(f"Found {len(filtered_df)} matching records")
-                    if not filtered_df.empty:
-                        st.dataframe(filtered_df, use_container_width=True)
-                    else:
-                        st.info(f"No matches found for '{search_term}' in column '{search_col}'")
-                except Exception as e:
-                    st.error(f"Error during search: {str(e)}")
+        with col3:
+            match_mode = st.selectbox("Match:", SEARCH_MODES, key=f"{key_prefix}_search_mode")
+            use_regex = st.checkbox("Regular expression", key=f"{key_prefix}_search_regex")
+        if search_term:
+            try:
+                positions = index.search(search_col, search_term, match_mode, use_regex)
+            except Exception as e:
+                st.error(f"Error during search: {str(e)}")
+                return
+            st.write(f"Found {len(positions)} matching records")
+            if len(positions) == 0:
+                st.info(f"No matches found for '{search_term}' in column '{search_col}'")
+                return
+
+    match_rows = total_rows if positions is None else len(positions)
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        page_size = st.selectbox("Rows per page:", PAGE_SIZES, key=f"{key_prefix}_page_size")
+    page_count = max(1, -(-match_rows // page_size))
+    page_key = f"{key_prefix}_page"
+    # The page lives only in session state (no widget default), so it can be clamped when a
+    # search shrinks the page count without Streamlit warning about two sources for the value
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    elif st.session_state[page_key] > page_count:
+        st.session_state[page_key] = page_count
+    with col2:
+        page = st.number_input(
+            f"Page (of {page_count}):",
+            min_value=1,
+            max_value=page_count,
+            step=1,
+            key=page_key
+        )
+    start_row = (page - 1) * page_size
+    end_row = min(start_row + page_size, match_rows)
+    if start_row > 0 or end_row < match_rows:
+        st.write(f"Showing rows {start_row} to {end_row - 1} of {match_rows}")
+    st.dataframe(index.rows(start_row, end_row, positions), use_container_width=True)
 
 def preview_keap_data(df, max_preview=50):
     """
     Show a quick preview of the first few rows of uploaded KEAP data in Streamlit.
     """
-    df = ensure_str_columns(df)
     if df is None or df.empty:
         st.info("No data available to preview.")
         return
@@ -80,4 +176,305 @@ def preview_keap_data(df, max_preview=50):
         max_value=min(max_preview, len(df)),
         value=min(10, len(df))
     )
-    st.dataframe(df.head(display_rows), use_container_width=True)
+    st.dataframe(ensure_str_columns(df.head(display_rows)), use_container_width=True)
+
+def apply_profile(profile, templates, source_df):
+    """
+    Replace the session's mappings with a profile's, validating every field in one pass.
+    Selectbox states are set directly, so the whole profile lands in a single rerun.
+    templates: {label: template DataFrame}.
+    Returns: {label: (fields applied, template fields not found, source columns not found)}.
+    """
+    report = {}
+    for label in MAPPING_LABELS:
+        template_df = templates[label]
+        fields = profile["mappings"].get(label, {}).get("fields", {})
+        applied, unknown_fields, missing_sources = validate_fields(fields, template_df.columns, source_df.columns)
+        mapping = {t_col: applied.get(t_col, "") for t_col in template_df.columns}
+        st.session_state[f"{label}_mapping"] = mapping
+        for t_col, s_col in mapping.items():
+            st.session_state[f"{label}_{t_col}"] = s_col
+        report[label] = (len(applied), unknown_fields, missing_sources)
+    return report
+
+def _apply_profile_callback(profile, templates, source_df):
+    st.session_state.profile_report = (profile["name"], apply_profile(profile, templates, source_df))
+
+def profile_loader(templates, source_df):
+    """
+    Offer saved mapping profiles whose template fingerprints match, plus profile import.
+    Must run before the mapping widgets so an applied profile shows up in the same rerun.
+    """
+    fingerprints = {label: template_fingerprint(df.columns) for label, df in templates.items()}
+    suggested = ProfileStore().suggest(fingerprints)
+    report = st.session_state.pop("profile_report", None)
+    with st.expander("📁 Mapping Profiles", expanded=bool(suggested) or report is not None):
+        if report is not None:
+            name, results = report
+            st.success(f"Applied profile '{name}'" if name else "Applied profile")
+            for label, (applied, unknown_fields, missing_sources) in results.items():
+                st.write(f"{label}: {applied} fields mapped")
+                if unknown_fields:
+                    st.warning(f"{label}: not in the current template: {', '.join(unknown_fields[:10])}")
+                if missing_sources:
+                    st.warning(f"{label}: not in the Allied data: {', '.join(missing_sources[:10])}")
+        if suggested:
+            names = [p["name"] for p in suggested]
+            choice = st.selectbox("Saved profiles matching these templates:", names, key="profile_choice")
+            st.button(
+                "Apply saved profile",
+                key="profile_apply_saved",
+                on_click=_apply_profile_callback,
+                args=(suggested[names.index(choice)], templates, source_df)
+            )
+        else:
+            st.caption("No saved profiles match these templates yet.")
+        uploaded = st.file_uploader(
+            "Import a profile (JSON or YAML)", type=["json", "yaml", "yml"], key="profile_upload"
+        )
+        if uploaded is not None:
+            try:
+                profile = load_profile(uploaded)
+            except ValueError as e:
+                st.error(f"Could not read profile: {str(e)}")
+            else:
+                st.button(
+                    "Apply imported profile",
+                    key="profile_apply_imported",
+                    on_click=_apply_profile_callback,
+                    args=(profile, templates, source_df)
+                )
+
+def profile_saver(templates, mappings):
+    """
+    Save the current mappings as a named profile, or download them as JSON/YAML.
+    """
+    with st.expander("💾 Save or Export Mapping Profile", expanded=False):
+        name = st.text_input("Profile name:", key="profile_name").strip()
+        profile = build_profile(name or "BlueSky Mapping", mappings, templates)
+        file_stem = name.replace(" ", "_") or "BlueSky_Mapping"
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("Save profile", key="profile_save", disabled=not name):
+                ProfileStore().save(profile)
+                st.success(f"Saved profile '{name}'")
+        with col2:
+            st.download_button(
+                "Download profile (JSON)", dump_profile(profile, "json"), f"{file_stem}.json", "application/json"
+            )
+        with col3:
+            try:
+                yaml_text = dump_profile(profile, "yaml")
+            except ValueError as e:
+                st.caption(str(e))
+            else:
+                st.download_button(
+                    "Download profile (YAML)", yaml_text, f"{file_stem}.yaml", "application/x-yaml"
+                )
+
+def validation_panel(report, outputs, max_rows=1000):
+    """
+    Data-quality results: failing cells per rule, and the rows that failed (with the rule names)
+    for each output, downloadable as CSV.
+    """
+    if report is None:
+        return
+    counts = report.counts()
+    total = sum(counts.values())
+    title = "🩺 Data Quality: all checks passed" if not total else f"🩺 Data Quality: {total} rows with issues"
+    with st.expander(title, expanded=False):
+        st.dataframe(report.summary(), hide_index=True, use_container_width=True)
+        for output, df in outputs.items():
+            if not counts.get(output):
+                continue
+            positions = report.rows_with_errors(output)
+            failing = df.iloc[positions].copy()
+            failing.insert(0, "Errors", report.error_labels(output, positions))
+            st.markdown(f"**{output}: {len(positions)} rows with issues**")
+            st.dataframe(failing.head(max_rows), use_container_width=True)
+            st.download_button(
+                f"Download {output} rows with issues", failing.to_csv(index=False).encode(),
+                f"{output.replace(' ', '_')}_issues.csv", "text/csv", key=f"validation_download_{output}"
+            )
+
+def performance_panel(recorder, profile=None):
+    """
+    Collapsible per-stage timings of the current (or last processed) run, with toggles for
+    tracemalloc allocation tracking and a cProfile dump of the next processing run.
+    """
+    with st.expander("⏱️ Performance", expanded=False):
+        summary = recorder.summary() if recorder is not None else None
+        if summary is None or summary.empty:
+            st.caption("No timings recorded yet.")
+        else:
+            st.dataframe(
+                summary.rename(columns={
+                    "stage": "Stage", "calls": "Calls", "seconds": "Seconds", "rows_in": "Rows in",
+                    "rows_out": "Rows out", "rss_peak_mb": "Peak RSS (MB)", "alloc_peak_mb": "Peak alloc (MB)"
+                }),
+                hide_index=True,
+                use_container_width=True
+            )
+            st.caption(f"Run {recorder.run_id}; sharded stages are summed across workers.")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.checkbox("Track memory allocations (tracemalloc, slower)", key="perf_tracemalloc")
+        with col2:
+            st.checkbox("Profile next processing run (cProfile)", key="perf_cprofile")
+        if profile:
+            st.download_button(
+                "Download cProfile dump", profile["dump"], "allied_pipeline.prof", "application/octet-stream"
+            )
+            st.code(profile["text"], language="text")
+
+def results_view(job_id, outputs, validation=None, recorder=None, profile=None):
+    """
+    Previews, downloads, data-quality and performance panels for one stored job.
+    outputs: {output name: DataFrame} as loaded from the job store; CSV/ZIP downloads are
+    encoded once into the job's directory and shared by every session showing the job.
+    """
+    general_df, reqdoc_df, specialty_df = outputs["General Info"], outputs["Required Docs"], outputs["Specialty"]
+    st.subheader("🔍 Data Preview")
+    preview_tabs = st.tabs(["General Info", "Required Docs", "Specialty Info"])
+    with preview_tabs[0]:
+        display_data_with_controls(general_df, "general", "general")
+    with preview_tabs[1]:
+        display_data_with_controls(reqdoc_df, "certification", "reqdoc")
+    with preview_tabs[2]:
+        display_data_with_controls(specialty_df, "specialty", "specialty")
+    st.subheader("📄 Download Transformed Files")
+    exports = ExportBundle(
+        general_df, reqdoc_df, specialty_df, recorder=recorder, cache_dir=default_store().path_for(job_id)
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "Download Caregiver General Info",
+            exports.csv_getter(GENERAL_CSV),
+            GENERAL_CSV,
+            "text/csv"
+        )
+        st.download_button(
+            "Download Caregiver Required Docs",
+            exports.csv_getter(REQDOC_CSV),
+            REQDOC_CSV,
+            "text/csv"
+        )
+        st.download_button(
+            "Download Caregiver Specialty Info",
+            exports.csv_getter(SPECIALTY_CSV),
+            SPECIALTY_CSV,
+            "text/csv"
+        )
+    with col2:
+        st.download_button(
+            "💾 Download All Files (ZIP)",
+            exports.zip_bytes,
+            ZIP_NAME,
+            "application/zip"
+        )
+    validation_panel(validation, outputs)
+    performance_panel(recorder, profile)
+
+def batch_options():
+    """
+    Output choices for a multi-file upload.
+    Returns: (multifile mode, whether to drop Person_keys already seen in an earlier file).
+    """
+    choice = st.radio("Batch output:", list(BATCH_MODES), key="batch_mode", horizontal=True)
+    mode = BATCH_MODES[choice]
+    dedupe = st.checkbox(
+        "Keep only the first file's rows for a Person_key found in several files",
+        value=True, key="batch_dedupe", disabled=mode != COMBINED
+    )
+    return mode, dedupe
+
+def _batch_table(files):
+    return pd.DataFrame([{
+        "File": report["name"],
+        "Status": report["status"],
+        "General": (report["rows"] or {}).get(OUTPUT_NAMES[0]),
+        "Required Docs": (report["rows"] or {}).get(OUTPUT_NAMES[1]),
+        "Specialty": (report["rows"] or {}).get(OUTPUT_NAMES[2]),
+        "Duplicates dropped": report["duplicates_dropped"],
+        "Error": report["error"] or ""
+    } for report in files]).astype({"General": "Int64", "Required Docs": "Int64", "Specialty": "Int64"})
+
+def run_batch(allied_files, templates, general_mapping, mode, dedupe):
+    """
+    Convert every uploaded Allied file in a worker pool, showing progress per file.
+    Outputs are written to a job directory in the job store (deleted on reset, or evicted with
+    the store's other jobs) rather than kept in memory.
+    Returns: convert_many's report plus "job_id", "out_dir" and "mode".
+    """
+    store = default_store()
+    job_id = store.create({"kind": "batch", "mode": mode})
+    out_dir = store.path_for(job_id)
+    sources = [(upload.name, upload_bytes(upload)) for upload in allied_files]
+    bar = st.progress(0.0, text=f"Converting {len(sources)} files...")
+    table = st.empty()
+
+    def report_progress(files, index, done):
+        bar.progress(done / len(files), text=f"{done}/{len(files)} files done (last: {files[index]['name']})")
+        table.dataframe(_batch_table(files), hide_index=True, use_container_width=True)
+
+    result = convert_many(
+        sources, templates["General Info"], templates["Required Docs"], templates["Specialty"],
+        general_mapping, out_dir, mode=mode, dedupe=dedupe, progress=report_progress
+    )
+    result.update(job_id=job_id, out_dir=out_dir, mode=mode)
+    return result
+
+def _file_reader(path):
+    """Zero-argument callable for st.download_button that reads the file only when downloaded."""
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+def _combined_zip(out_dir):
+    def build():
+        zip_path = os.path.join(out_dir, ZIP_NAME)
+        if not os.path.exists(zip_path):
+            zip_csv_files([os.path.join(out_dir, name) for name in OUTPUT_NAMES], zip_path)
+        return _file_reader(zip_path)()
+    return build
+
+def batch_results_view(result):
+    """Per-file results of a multi-file run, with downloads streamed from disk."""
+    # Loading the (output-less) job marks it as used, so it isn't evicted while it is on screen
+    if default_store().load(result["job_id"]) is None:
+        st.error("Batch results are missing or have expired. Please convert the files again.")
+        return
+    files = result["files"]
+    failed = [report for report in files if report["status"] == "failed"]
+    done = len(files) - len(failed)
+    st.subheader("📚 Batch Results")
+    if failed:
+        st.warning(f"⚠️ {done} of {len(files)} files converted; {len(failed)} failed (see the Error column).")
+    else:
+        st.success(f"✅ All {len(files)} files converted")
+    st.dataframe(_batch_table(files), hide_index=True, use_container_width=True)
+    st.subheader("📄 Download Transformed Files")
+    if result["mode"] == COMBINED:
+        dropped = sum(report["duplicates_dropped"] for report in files)
+        if dropped:
+            st.markdown(f"**{dropped} Person_keys found in more than one file were kept from the first file only**")
+        col1, col2 = st.columns(2)
+        with col1:
+            for name in OUTPUT_NAMES:
+                st.download_button(
+                    f"Download {name}", _file_reader(os.path.join(result["out_dir"], name)), name, "text/csv",
+                    key=f"batch_download_{name}"
+                )
+        with col2:
+            st.download_button(
+                "💾 Download All Files (ZIP)", _combined_zip(result["out_dir"]), ZIP_NAME, "application/zip",
+                key="batch_download_zip"
+            )
+    else:
+        for path in result["outputs"]:
+            name = os.path.basename(path)
+            st.download_button(
+                f"Download {name}", _file_reader(path), name, "application/zip", key=f"batch_download_{name}"
+            )
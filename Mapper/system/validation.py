@@ -0,0 +1,168 @@
+# validation.py
+"""
+Columnar default-filling and data-quality checks for the BlueSky outputs.
+
+Rules are declared in setup.VALIDATION_RULES. Membership and date checks run on a column's
+distinct values (pd.factorize) and are broadcast back through the codes, so their cost grows with
+the number of distinct values rather than rows; regex checks run over the whole column in pyarrow's
+vectorized engine when it is installed (it ships with Streamlit). Failures are packed into one
+bitmap per output: bit i of a row is set when the row fails rule i in any of that rule's columns.
+"""
+import numpy as np
+import pandas as pd
+from setup import REQUIRED_DEFAULTS, VALIDATION_RULES
+from globals import ALLIED_SPECIALTIES
+from helpers import mark_str_normalized
+from instrument import stage as perf_stage
+
+CHECKS = ["regex", "isin", "date"]
+
+def build_rules(rules=VALIDATION_RULES, specialties=ALLIED_SPECIALTIES):
+    """The given rules, plus a Specialty membership rule when a specialty list is configured."""
+    rules = list(rules)
+    if specialties:
+        rules.append({"name": "specialty", "output": "Specialty", "columns": ["Specialty"],
+                      "check": "isin", "values": specialties})
+    for rule in rules:
+        if rule["check"] not in CHECKS:
+            raise ValueError(f"Unknown check {rule['check']!r} in validation rule {rule['name']!r}")
+    return rules
+
+def _blank_mask(series):
+    return (series.isna() | (series == "")).to_numpy(dtype=bool)
+
+def fill_defaults(df, defaults=REQUIRED_DEFAULTS):
+    """
+    Fill blank (empty or missing) cells of the given columns with their default, in place.
+    Returns: {column: cells filled}.
+    """
+    filled = {}
+    for column, default in defaults.items():
+        if column not in df.columns:
+            continue
+        blank = _blank_mask(df[column])
+        filled[column] = int(blank.sum())
+        if not filled[column]:
+            continue
+        values = df[column].to_numpy(dtype=object, copy=True)
+        values[blank] = default
+        df[column] = mark_str_normalized(pd.array(values, dtype="string", copy=False))
+    return filled
+
+def _fullmatch(values, pattern):
+    """Boolean array: which values fully match pattern (missing values do not)."""
+    try:
+        matched = pd.Series(values, dtype="string[pyarrow]").str.fullmatch(pattern)
+    except (ImportError, ValueError):
+        # No pyarrow, or a pattern its RE2 engine rejects (e.g. lookarounds)
+        matched = pd.Series(values, dtype="string").str.fullmatch(pattern)
+    return matched.fillna(False).to_numpy(dtype=bool)
+
+def _failing_uniques(uniques, rule):
+    """Boolean array: which distinct (non-blank) values fail a membership or date rule."""
+    values = pd.Series(uniques, dtype="string")
+    if rule["check"] == "isin":
+        ok = values.str.strip().str.upper().isin({str(v).upper() for v in rule["values"]})
+    else:
+        dates = pd.to_datetime(values, errors="coerce", format="mixed")
+        ok = dates.notna()
+        if rule.get("min"):
+            ok &= dates >= pd.Timestamp(rule["min"])
+        if rule.get("max"):
+            ok &= dates <= pd.Timestamp(rule["max"]).normalize() + pd.Timedelta(days=1)
+    return ~ok.fillna(False).to_numpy(dtype=bool) & (values != "").to_numpy(dtype=bool)
+
+def check_column(series, rule):
+    """Per-row failure mask of one rule on one column (blank cells pass)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Already factorized: check the categories and broadcast through the codes
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        if rule["check"] == "regex":
+            failing = ~_fullmatch(uniques, rule["pattern"]) & (uniques != "")
+            return np.append(failing, False)[codes]
+    elif rule["check"] == "regex":
+        return ~_fullmatch(series, rule["pattern"]) & ~_blank_mask(series)
+    else:
+        codes, uniques = pd.factorize(series)
+    if not len(uniques):
+        return np.zeros(len(series), dtype=bool)
+    failing = _failing_uniques(uniques, rule)
+    # Missing values get code -1; map them to an extra "passes" slot
+    return np.append(failing, False)[codes]
+
+def _bitmap_dtype(n_rules):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_rules <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError("At most 64 validation rules are supported")
+
+class ValidationReport:
+    """
+    Result of validating the outputs: per-output row bitmaps, rule names and summary counts.
+    bitmaps[output][row] has bit i set when that row failed rules[i].
+    """
+
+    def __init__(self, rules, bitmaps, failures):
+        self.rules = rules
+        self.bitmaps = bitmaps
+        self.failures = failures
+
+    @property
+    def rule_names(self):
+        return [rule["name"] for rule in self.rules]
+
+    def rows_with_errors(self, output):
+        """Positions of rows in `output` that failed at least one rule."""
+        return np.flatnonzero(self.bitmaps[output])
+
+    def error_labels(self, output, positions=None):
+        """Comma-separated names of the failed rules for each row (or the given row positions)."""
+        bits = self.bitmaps[output] if positions is None else self.bitmaps[output][positions]
+        labels = np.full(len(bits), "", dtype=object)
+        for i, name in enumerate(self.rule_names):
+            failed = (bits >> i) & 1 == 1
+            labels[failed] = np.where(labels[failed] == "", name, labels[failed] + ", " + name)
+        return labels
+
+    def summary(self):
+        """One row per rule and column checked, with the number of failing cells."""
+        rows = [
+            {"Output": output, "Rule": name, "Column": column, "Failed": count}
+            for (output, name, column), count in self.failures.items()
+        ]
+        return pd.DataFrame(rows, columns=["Output", "Rule", "Column", "Failed"])
+
+    def counts(self):
+        """{output: rows with at least one failure}."""
+        return {output: int(np.count_nonzero(bits)) for output, bits in self.bitmaps.items()}
+
+def validate_outputs(outputs, rules=None):
+    """
+    Run the rules (default: build_rules()) over {output name: DataFrame}.
+    Returns: ValidationReport (columns missing from an output are skipped).
+    """
+    rules = build_rules() if rules is None else rules
+    with perf_stage("validate", rows_in=sum(len(df) for df in outputs.values())):
+        return _validate(outputs, rules)
+
+def _validate(outputs, rules):
+    dtype = _bitmap_dtype(len(rules))
+    bitmaps = {output: np.zeros(len(df), dtype=dtype) for output, df in outputs.items()}
+    failures = {}
+    # Columns mapped from the same Allied column share one array; check it once per rule
+    checked = {}
+    for bit, rule in enumerate(rules):
+        output = rule.get("output", "General Info")
+        df = outputs.get(output)
+        if df is None:
+            continue
+        for column in rule["columns"]:
+            if column not in df.columns:
+                continue
+            key = (bit, id(df[column].array))
+            if key not in checked:
+                checked[key] = check_column(df[column], rule)
+            failed = checked[key]
+            failures[(output, rule["name"], column)] = int(failed.sum())
+            bitmaps[output][failed] |= dtype(1 << bit)
+    return ValidationReport(rules, bitmaps, failures)